@@ -0,0 +1,151 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from metrics import record_call, watch
+from scheduler import observe
+
+# How long a Yahoo access token lasts, in seconds
+TOKEN_LIFETIME = 3600
+
+# Every TokenManager made by token_manager(), by the absolute path of its token file
+MANAGERS = dict()
+MANAGERS_LOCK = threading.Lock()
+
+
+class TokenManager:
+    """
+    One Yahoo OAuth token and one HTTP session, shared by every Roster (and every process) using the same token file
+
+    The token is kept in memory with its expiry, so checking it doesn't touch the disk. Refreshing it
+    takes a lock on the token file first, and then reads the file again: if another process has already
+    refreshed the token, that token is used instead of refreshing it again. So however many runs are going
+    at once, the token is only refreshed once.
+
+    Every Yahoo call goes through the same keep-alive session, which is kept when the token is refreshed
+    (only its token changes), so connections to Yahoo are reused rather than set up again.
+    """
+
+    def __init__(self, path: str = "oauth.json", pool_size: int = 16, margin: float = 60):
+        """
+        :param path: where the OAuth token is saved
+        :param pool_size: how many connections to Yahoo to keep open (at least as many as there are worker threads)
+        :param margin: how many seconds before the token expires to refresh it
+        """
+        self.path = path
+        self.pool_size = pool_size
+        self.margin = margin
+        self.oauth = None
+        self.session = None
+        self.expires = 0.0
+        self.refreshes = 0
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def file_lock(self):
+        """
+        Holds an exclusive lock on the token file (well, on a file next to it) across threads and processes
+        """
+        with self.lock, open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires - self.margin
+
+    def get(self):
+        """
+        The shared OAuth2 session, with a token that's good for at least 'margin' more seconds
+
+        :return: a yahoo_oauth.OAuth2
+        """
+        if self.oauth is not None and self.is_fresh():
+            return self.oauth
+        with self.lock:
+            if self.oauth is None:
+                self.load()
+            elif not self.is_fresh():
+                self.refresh_access_token()
+            return self.oauth
+
+    def load(self) -> None:
+        """
+        Makes the OAuth2 session from the token file (which refreshes the token, if it's expired)
+        """
+        import requests.adapters  # (Imported here, like yahoo_oauth, so runs that never need them don't wait)
+        import yahoo_oauth
+
+        with self.file_lock():
+            oauth = yahoo_oauth.OAuth2(None, None, from_file=self.path)
+
+        session = oauth.session
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        watch(session)
+        observe(session)
+
+        # yfa refreshes the token itself when Yahoo says it's expired, and then makes a new session
+        # (https://github.com/josuebrunel/yahoo-oauth/issues/55#issuecomment-602217706). Both go through here instead
+        oauth.refresh_access_token = self.refresh_access_token
+        oauth.oauth.get_session = lambda token=None, **kwargs: self.session
+
+        self.oauth, self.session = oauth, session
+        self.expires = oauth.token_time + TOKEN_LIFETIME
+
+    def adopt(self, data: dict) -> None:
+        """
+        Uses a token (e.g., one that another process refreshed) in the shared session
+        """
+        for key in ("access_token", "refresh_token", "token_type", "token_time"):
+            setattr(self.oauth, key, data[key])
+        self.session.access_token = data["access_token"]
+        self.expires = data["token_time"] + TOKEN_LIFETIME
+
+    def refresh_access_token(self) -> dict:
+        """
+        Refreshes the token, unless another process (or thread) already has since this one was last used
+
+        :return: the new credentials, like yahoo_oauth.OAuth2.refresh_access_token()
+        """
+        import yahoo_oauth
+
+        # The token the caller has (worked out before waiting for the lock, since whoever has the lock
+        # might be refreshing it right now)
+        seen = self.oauth.token_time
+        with self.file_lock():
+            with open(self.path) as f:
+                data = json.load(f)
+            if max(data.get("token_time", 0), self.oauth.token_time) <= seen:
+                credentials = yahoo_oauth.OAuth2.refresh_access_token(self.oauth)
+                data.update(credentials)
+                self.refreshes += 1
+                record_call("oauth/refresh")
+
+                tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+                with open(tmp_path, "w") as f:
+                    f.write(json.dumps(data))
+                os.replace(tmp_path, self.path)
+            elif self.oauth.token_time > data.get("token_time", 0):
+                data = {key: getattr(self.oauth, key) for key in ("access_token", "refresh_token", "token_type",
+                                                                  "token_time")}
+            self.adopt(data)
+
+        return {key: data[key] for key in ("access_token", "token_type", "refresh_token", "token_time")}
+
+
+def token_manager(path: str = "oauth.json") -> TokenManager:
+    """
+    The TokenManager for a token file, so everything in a process that uses the file shares it
+
+    :param path: where the OAuth token is saved
+    """
+    key = os.path.abspath(path)
+    with MANAGERS_LOCK:
+        if key not in MANAGERS:
+            MANAGERS[key] = TokenManager(path)
+        return MANAGERS[key]
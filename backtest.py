@@ -0,0 +1,195 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import fixtures
+import set_lineup
+from cache import ResponseCache
+from set_lineup import (Roster, Assignment, INACTIVE_POSITIONS, blend_values, eligibility_matrix, lineup_slots,
+                        magic_weights, norm_params, slot_weights)
+
+# Fantasy points for each stat in a box score line (mlbgame.PlayerStats attributes)
+BATTING_POINTS = {"r": 1, "h": 1, "d": 1, "t": 2, "hr": 3, "rbi": 1, "bb": 1, "sb": 2}  # (hits count as total bases)
+PITCHING_POINTS = {"out": 1, "so": 1, "er": -2, "h": -1, "bb": -1}
+WIN_POINTS = 5
+SAVE_POINTS = 5
+
+# The sources the "magic" valuation blends (see Roster.value_players())
+SOURCES = ("season", "lastmonth", "steamer")
+
+# The days being backtested, in each worker process (see evaluate())
+DAYS = []
+
+
+def box_score_points(when: date) -> dict:
+    """
+    How many fantasy points each player scored on a day, from the MLB GameDay box scores
+
+    :param when: the date
+    :return: a dict of (cleaned up) player name -> points
+    """
+    o = defaultdict(float)
+    for game in set_lineup.mlbgame.day(when.year, when.month, when.day):
+        if game.game_status != "FINAL":
+            continue
+        stats = set_lineup.mlbgame.player_stats(game.game_id)
+        for player in stats.home_batting + stats.away_batting:
+            name = Roster.cleanup_name(player.name_display_first_last)
+            o[name] += sum(points * getattr(player, stat, 0) for stat, points in BATTING_POINTS.items())
+        for player in stats.home_pitching + stats.away_pitching:
+            name = Roster.cleanup_name(player.name_display_first_last)
+            o[name] += sum(points * getattr(player, stat, 0) for stat, points in PITCHING_POINTS.items())
+            o[name] += WIN_POINTS * (getattr(player, "win", "") == "true")
+            o[name] += SAVE_POINTS * (getattr(player, "save", "") == "true")
+    return dict(o)
+
+
+def replay_day(league_key: str, oauth, details_path: str) -> dict:
+    """
+    Everything a day's lineup depended on for a team, read from a recording (call it inside fixtures.replay())
+
+    :param league_key: the team's league
+    :param oauth: the (replayed) OAuth session
+    :param details_path: somewhere to put the player details cache
+    :return: a dict with the keys league_key, date, week, positions, players (the roster, indexed by name)
+        and raw (each source's player values, indexed by player_id)
+    """
+    ros = Roster(league_key, values="magic", oauth=oauth, details_path=details_path, lazy=True)
+    roster = ros.roster
+    pids = roster['player_id'].astype(int).to_numpy()
+    raw = pd.DataFrame({source: ros.valuations[source].reindex(pids) for source in SOURCES}, index=pids)
+    return {"league_key": league_key,
+            "date": ros.when.date(),
+            "week": ros.cache.get("current_week", league_key, ros.league.current_week),
+            "positions": ros.positions,
+            "players": roster[['player_id', 'status', 'eligible_positions', 'is_playing']].copy(),
+            "raw": raw}
+
+
+def load_days(paths: list, boxscores_dir: str = "data/boxscores") -> list:
+    """
+    Reads every team's day out of recordings made with `set_lineup.py --record` (one recording a day),
+    and finds out how many points each player actually scored that day
+
+    :param paths: the recordings
+    :param boxscores_dir: where to keep the box scores, so they're only fetched once
+    :return: a list of days (see replay_day()) with a 'points' dict too, sorted by league and date
+    """
+    logging.getLogger('yahoo-fantasy').disabled = True
+    days = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in paths:
+            with fixtures.replay(path, set_lineup) as tape:
+                oauth = set_lineup.update_oauth()
+                for league_key in tape.idents("league"):
+                    days.append(replay_day(league_key, oauth, os.path.join(tmp, "player_details.json")))
+
+    # (Outside of the replays, since the box scores come out after the recordings were made)
+    cache = ResponseCache(disk_dir=boxscores_dir)
+    for day in days:
+        day["points"] = cache.get("boxscore", day["date"], lambda: box_score_points(day["date"]))
+    return sorted(days, key=lambda day: (day["league_key"], day["date"]))
+
+
+def config_grid(total_weeks=(9, 13, 26), starts=(0.0, 0.25, 0.5), ends=(0.5, 0.75, 1.0),
+                season_shares=(0.25, 0.5, 0.75)) -> list:
+    """
+    Every way of valuing players to try: each of the single sources, and "magic" with every
+    combination of the given weights (see magic_weights())
+
+    :return: a list of configurations, each a dict with a 'how' key and (for "magic") magic_weights() settings
+    """
+    o = [{"how": source} for source in SOURCES]
+    for weeks, start, end, share in itertools.product(total_weeks, starts, ends, season_shares):
+        o.append({"how": "magic", "total_weeks": weeks, "start": start, "end": end, "season_share": share})
+    return o
+
+
+def day_points(day: dict, config: dict) -> float:
+    """
+    How many points a team would have scored on a day, had its lineup been set with a configuration
+
+    :param day: a day from load_days()
+    :param config: a configuration from config_grid()
+    :return: the points scored by the players in the lineup's active slots
+    """
+    raw = day["raw"]
+    if config["how"] == "magic":
+        weights = magic_weights(day["week"], **{k: v for k, v in config.items() if k != "how"})
+        values = blend_values(raw, day["norms"], weights)
+    else:
+        values = raw[config["how"]]
+    players = day["players"]
+    values = np.nan_to_num(values.reindex(players['player_id'].astype(int)).to_numpy(dtype=float))
+
+    # The same problem as Roster.optimize_lineup(), without the tiebreakers
+    slots = day["slots"]
+    inactive = np.isin(slots, INACTIVE_POSITIONS)
+    is_playing = players['is_playing'].to_numpy()
+    weights = slot_weights(day["eligible"], inactive, is_playing, values, 2 * np.abs(values).sum() + 1)
+    matching = Assignment(np.hstack([weights, np.zeros((len(slots), len(slots)))])).matching()
+
+    points = day["points"]
+    starters = [players.index[col] for row, col in enumerate(matching)
+                if col < len(players) and weights[row, col] > 0 and not inactive[row]]
+    return sum(points.get(name, 0.0) for name in starters)
+
+
+def init_worker(days: list) -> None:
+    global DAYS
+    DAYS = days
+
+
+def evaluate(config: dict) -> dict:
+    """
+    Backtests one configuration over every day (in a worker process, see init_worker())
+
+    :return: the configuration, plus the points it scored in each league and in total
+    """
+    leagues = defaultdict(float)
+    for day in DAYS:
+        leagues[day["league_key"]] += day_points(day, config)
+    return dict(config, points=sum(leagues.values()), leagues=dict(leagues))
+
+
+def backtest(days: list, configs: list, workers: int = None) -> pd.DataFrame:
+    """
+    Backtests every configuration over every day, spread over a pool of processes
+
+    :param days: from load_days()
+    :param configs: from config_grid()
+    :param workers: how many processes (defaults to one per CPU)
+    :return: a dataframe with one row per configuration, best first
+    """
+    # Work out everything that doesn't depend on the configuration once, up front
+    for day in days:
+        day["slots"] = lineup_slots(day["positions"])['pos'].to_numpy()
+        day["eligible"] = eligibility_matrix(day["players"]['eligible_positions'], day["positions"])[
+            day["slots"]].to_numpy().T
+        day["norms"] = {source: norm_params(day["raw"][source]) for source in SOURCES}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(days,)) as pool:
+        results = list(pool.map(evaluate, configs, chunksize=max(1, len(configs) // (4 * (workers or os.cpu_count())))))
+    return pd.DataFrame(results).sort_values("points", ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest ways of valuing players over recorded days")
+    parser.add_argument("recordings", nargs="+", help="recordings made with set_lineup.py --record, one a day")
+    parser.add_argument("--workers", type=int, help="how many processes (default: one per CPU)")
+    parser.add_argument("--boxscores-dir", default="data/boxscores", help="where to keep box scores")
+    parser.add_argument("--output", default="backtest.json", help="where to write the results (JSON)")
+    args = parser.parse_args()
+
+    results = backtest(load_days(args.recordings, args.boxscores_dir), config_grid(), args.workers)
+    print(results.drop(columns="leagues").head(20).to_string(float_format="{:.2f}".format))
+    with open(args.output, "w") as f:
+        f.write(json.dumps({"generated": datetime.now().isoformat(),
+                            "results": results.to_dict("records")}, indent=2))
@@ -0,0 +1,370 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import fixtures
+import free_agents
+from metrics import Metrics
+from scheduler import RequestScheduler
+import set_lineup
+from set_lineup import Roster, INACTIVE_POSITIONS
+
+# A typical Yahoo roster setup
+POSITIONS = {
+    "C": {"count": 1, "position_type": "B"},
+    "1B": {"count": 1, "position_type": "B"},
+    "2B": {"count": 1, "position_type": "B"},
+    "3B": {"count": 1, "position_type": "B"},
+    "SS": {"count": 1, "position_type": "B"},
+    "OF": {"count": 3, "position_type": "B"},
+    "Util": {"count": 2, "position_type": "B"},
+    "SP": {"count": 2, "position_type": "P"},
+    "RP": {"count": 2, "position_type": "P"},
+    "P": {"count": 4, "position_type": "P"},
+    "BN": {"count": 5},
+    "IL": {"count": 2},
+    "NA": {"count": 1}}
+
+BATTER_ELIGIBILITY = [["C"], ["1B"], ["2B"], ["3B"], ["SS"], ["OF"],
+                      ["2B", "SS"], ["1B", "3B"], ["1B", "OF"], ["C", "1B"], ["2B", "3B", "SS", "OF"]]
+PITCHER_ELIGIBILITY = [["SP"], ["RP"], ["SP", "RP"]]
+
+
+def synthetic_roster(n_players: int, seed: int = 0, names: list = None) -> pd.DataFrame:
+    """
+    Makes up a roster that looks like what Roster.__init__ builds
+
+    :param n_players: how many players on the roster
+    :param seed: seed for the random number generator
+    :param names: player names to use (defaults to "Player 0", "Player 1", ...)
+    :return: a dataframe indexed by player name
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_players):
+        batter = rng.random() < 0.55
+        if batter:
+            elig = list(BATTER_ELIGIBILITY[rng.integers(len(BATTER_ELIGIBILITY))]) + ["Util"]
+        else:
+            elig = list(PITCHER_ELIGIBILITY[rng.integers(len(PITCHER_ELIGIBILITY))]) + ["P"]
+        status = rng.choice(["", "", "", "", "", "", "DTD", "IL", "NA"])
+        if status in ("IL", "NA"):
+            elig.append(status)
+        rows.append({"name": "Player {}".format(i) if names is None else names[i],
+                     "player_id": 10000 + i,
+                     "status": status,
+                     "position_type": "B" if batter else "P",
+                     "eligible_positions": elig,
+                     "selected_position": "BN",
+                     "value": rng.normal(2, 1.5),
+                     "team": "Tor",
+                     "is_playing": -1 if status in ("IL", "NA") else int(rng.random() < 0.8 and status == "")})
+    return pd.DataFrame(rows).set_index("name")
+
+
+def offline_roster(roster: pd.DataFrame, positions: dict = None) -> Roster:
+    """
+    Builds a Roster around an existing roster dataframe without talking to Yahoo
+    """
+    ros = Roster.__new__(Roster)
+    ros.logger = logging.getLogger('yahoo-fantasy-benchmark')
+    ros.logger.disabled = True
+    ros.metrics = Metrics(enabled=False)
+    ros.positions = POSITIONS if positions is None else positions
+    ros.roster = roster
+    return ros
+
+
+def lineup_value(ros: Roster, lineup: pd.DataFrame) -> float:
+    """
+    Total value of the players that would actually play in a lineup
+    """
+    active = lineup[~lineup['target_position'].isin(("BN",) + INACTIVE_POSITIONS)].index
+    playing = ros.roster.loc[active]
+    return float(playing.loc[playing['is_playing'] == 1, 'value'].sum())
+
+
+def time_it(f, repeat: int) -> float:
+    """
+    Best wall-clock time of a few calls to f, in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def optimize_lineup_greedy(ros: Roster) -> pd.DataFrame:
+    """
+    The original slot-by-slot heuristic that Roster.optimize_lineup() replaced. It can misplace
+    multi-position players, and is only kept around to compare against optimize_lineup()
+    """
+
+    lineup = pd.DataFrame(ros.positions).T
+    lineup = lineup.loc[lineup.index.repeat(np.array(lineup['count']))]
+    lineup = lineup[lineup.index != "BN"]
+    lineup = lineup.reset_index()
+    lineup = lineup.rename(columns={"index": "pos"})
+    lineup['final_player'] = [None for _ in range(0, len(lineup))]
+    assigned_players = []
+
+    while None in lineup['final_player'].unique():
+        for _ in (_ for _ in lineup.final_player if _ is None):
+            lineup['eligible_players'] = [[] for _ in range(0, len(lineup))]
+            # Assign each position a list of eligible players
+            for row in lineup.itertuples():
+                index, pos, _, _, final_player, eligible_players = row
+                # If there's already a player assigned to the position, continue
+                if final_player:
+                    continue
+                for player in ros.roster.itertuples():
+                    name, _, _, _, eligible_positions, *_ = player
+                    # If the player is already assigned, next
+                    if name in assigned_players:
+                        continue
+                    if pos in eligible_positions:
+                        eligible_players.append(name)
+                # If there's only one eligible player, cut to the chase and assign him
+                if len(eligible_players) == 1:
+                    lineup.loc[index, 'final_player'] = eligible_players[0]
+                    ros.logger.info("Assigning {player} to {pos}".format(
+                        player=eligible_players[0],
+                        pos=lineup.loc[index, 'pos']))
+                    assigned_players = [player for player in lineup.final_player if player is not None]
+
+        # Perform tiebreakers based on expected value
+        tb_row = np.where([x is None for x in lineup.final_player])[0][0]  # Which row to tiebreak
+        # If there are no eligible players, put the final player in the slot as "Empty"
+        if len(lineup.eligible_players[tb_row]) == 0:
+            lineup.loc[tb_row, "final_player"] = "Empty"
+            continue
+        tb = ros.roster[ros.roster.index.isin(lineup.eligible_players[tb_row])]  # Filter roster for those players
+        tb = tb.assign(value=tb.is_playing * tb.value)  # Approximate their value
+        try:
+            best = tb.index[tb.value == max(tb.value)][0]  # Player with highest value
+            ros.logger.info("Optimizing {player} to {pos}".format(
+                player=best,
+                pos=lineup.pos[tb_row]))
+        except IndexError:
+            ros.logger.warning("Failed assigning {}".format(lineup.pos[tb_row]))
+
+        lineup.loc[tb_row, "final_player"] = best
+        assigned_players = [player for player in lineup['final_player'].unique() if player is not None]
+
+    o = ros.roster[['selected_position', 'player_id']].join(lineup.set_index('final_player'))
+    o['pos'] = o['pos'].fillna("BN")
+    o = o.rename(columns={"pos": "target_position",
+                          "selected_position": "current_position"})
+    ros.logger.info("Finished optimizing lineup!")
+    return o
+
+
+def bench_optimizers(sizes=(25, 50, 200), repeat: int = 3) -> pd.DataFrame:
+    """
+    Compares optimize_lineup() with the old greedy loop on synthetic rosters, and times
+    update_lineup() repairing the lineup after one player's status changes
+    """
+    results = []
+    for size in sizes:
+        ros = offline_roster(synthetic_roster(size))
+        scratch = ros.roster.index[ros.roster['is_playing'] == 1][0]
+
+        def update():
+            ros.update_lineup({scratch: 1 - ros.roster.loc[scratch, 'is_playing']})  # Scratched, then back again
+
+        results.append({"players": size,
+                        "greedy_s": time_it(lambda: optimize_lineup_greedy(ros), repeat),
+                        "assignment_s": time_it(ros.optimize_lineup, repeat),
+                        "update_s": time_it(update, repeat),
+                        "greedy_value": lineup_value(ros, optimize_lineup_greedy(ros)),
+                        "assignment_value": lineup_value(ros, ros.optimize_lineup())})
+    o = pd.DataFrame(results).set_index("players")
+    o["speedup"] = o["greedy_s"] / o["assignment_s"]
+    return o
+
+
+def projected_names(n_players: int, seed: int = 0) -> list:
+    """
+    Real player names from the Steamer projections, so that valuations have something to find.
+    Names are drawn from the best-projected players, like a real roster would be.
+    """
+    projections = pd.concat([pd.read_csv(path, usecols=["Name", "WAR"]) for path in
+                             ("data/proj_steamer_2020_b.csv", "data/proj_steamer_2020_p.csv")])
+    names = projections.sort_values("WAR", ascending=False)["Name"].unique()[:max(2 * n_players, 500)]
+    return list(np.random.default_rng(seed).choice(names, size=n_players, replace=False))
+
+
+@contextmanager
+def synthetic_api(roster: pd.DataFrame, when: datetime = datetime(2020, 8, 15, 9), pool: pd.DataFrame = None):
+    """
+    Stands in for Yahoo, MLB GameDay and OAuth with made-up responses for a roster
+    (from synthetic_roster()), so the whole pipeline can run on rosters of any size
+
+    :param pool: free agents (also from synthetic_roster(), with different player_ids), if any
+    """
+    rng = np.random.default_rng(0)
+    players = roster.reset_index()
+    free_agents = pool.reset_index() if pool is not None else players.iloc[:0]
+    everyone = pd.concat([players, free_agents]).set_index("player_id")
+
+    def player_stats(player_ids, req_type, **kwargs):
+        batter = everyone.loc[player_ids, "position_type"] == "B"
+        return [{"player_id": pid, "OPS": rng.normal(0.75, 0.1) if b else np.nan, "ERA": rng.gamma(8, 0.5),
+                 "wRAA": rng.normal(0, 8) if b else np.nan, "FIP": rng.gamma(8, 0.5)}
+                for pid, b in zip(player_ids, batter)]
+
+    league = SimpleNamespace(
+        positions=lambda: POSITIONS,
+        team_key=lambda: "398.l.1.t.1",
+        current_week=lambda: 4,
+        settings=lambda: {"name": "Synthetic League", "league_key": "398.l.1"},
+        player_details=lambda player_ids: [{"player_id": str(pid), "editorial_team_abbr": "Tor"}
+                                           for pid in player_ids],
+        player_stats=player_stats,
+        league_id="398.l.1",
+        # A page of free agents comes back as is, so there's nothing to pull the players out of
+        yhandler=SimpleNamespace(get_players_raw=lambda league_id, start, status, position=None: free_agents.loc[
+            free_agents["eligible_positions"].map(lambda elig: position in elig),
+            ["player_id", "name", "status", "position_type", "eligible_positions"]].iloc[start:start + 25]
+            .to_dict("records")),
+        _players_from_page=lambda page: (len(page), page))
+    team = SimpleNamespace(
+        roster=lambda day=None: players[["player_id", "name", "status", "position_type",
+                                         "eligible_positions", "selected_position"]].to_dict("records"),
+        change_positions=lambda time_frame, modified_lineup: None)
+    games = [SimpleNamespace(date=when.replace(hour=19), game_status="PRE_GAME", home_team="Blue Jays",
+                             away_team="Yankees", p_pitcher_home=name, p_pitcher_away="")
+             for name in players.loc[players["position_type"] == "P", "name"]]
+
+    originals = fixtures.patch(
+        set_lineup,
+        datetime=fixtures.frozen_datetime(when),
+        update_oauth=lambda *args, **kwargs: SimpleNamespace(token_is_valid=lambda: True),
+        yfa=SimpleNamespace(league=SimpleNamespace(League=lambda sc, key: league),
+                            team=SimpleNamespace(Team=lambda sc, key: team)),
+        mlbgame=SimpleNamespace(day=lambda year, month, day: games))
+    try:
+        yield
+    finally:
+        fixtures.patch(set_lineup, **originals)
+
+
+def unthrottled() -> RequestScheduler:
+    """
+    A scheduler that lets every call straight through, so the benchmarks time the code rather than
+    the rate limit (nothing here calls Yahoo)
+    """
+    return RequestScheduler(rate=float("inf"))
+
+
+def bench_pipeline(league_key: str, values: str = "magic", repeat: int = 3) -> dict:
+    """
+    Times each stage of the pipeline for a league (through whatever API is patched in at the time)
+
+    :return: a dict of stage -> best time in seconds, plus the number of players
+    """
+    logging.getLogger('yahoo-fantasy').disabled = True
+    with tempfile.TemporaryDirectory() as tmp:
+        details_path = os.path.join(tmp, "player_details.json")
+
+        def build():
+            if os.path.exists(details_path):
+                os.remove(details_path)  # Always start cold
+            return Roster(league_key, values=values, details_path=details_path, scheduler=unthrottled())
+
+        ros = build()
+
+        def value():
+            ros.valuations = dict()
+            return ros.value_players(values, log=False)
+
+        target = ros.optimize_lineup()
+        return {"players": len(ros.roster),
+                "init": time_it(build, repeat),
+                "value_players": time_it(value, repeat),
+                "optimize_lineup": time_it(ros.optimize_lineup, repeat),
+                "set_lineup": time_it(lambda: ros.set_lineup(target), repeat)}
+
+
+def bench_free_agents(sizes=(1000, 5000), repeat: int = 1) -> pd.DataFrame:
+    """
+    Times scanning free-agent pools of a few sizes, and finding the best swaps, for a synthetic team
+    """
+    logging.getLogger('yahoo-fantasy').disabled = True
+    names = projected_names(max(sizes) + 25)
+    results = []
+    for size in sizes:
+        pool = synthetic_roster(size, seed=1, names=names[25:]).assign(player_id=lambda x: 20000 + np.arange(size))
+        with synthetic_api(synthetic_roster(25, names=names), pool=pool), tempfile.TemporaryDirectory() as tmp:
+            ros = Roster("398.l.1", values="magic", details_path=os.path.join(tmp, "player_details.json"),
+                         scheduler=unthrottled())
+            candidates = free_agents.scan_free_agents(ros)
+            results.append({"players": size,
+                            "scan_s": time_it(lambda: free_agents.scan_free_agents(ros), repeat),
+                            "swaps_s": time_it(lambda: free_agents.best_swaps(ros, candidates), repeat),
+                            "candidates": len(candidates)})
+    return pd.DataFrame(results).set_index("players")
+
+
+def bench_suite(sizes=(25, 200, 1000), replay_paths=(), values: str = "magic", repeat: int = 3) -> list:
+    """
+    Runs the pipeline benchmark over synthetic rosters and recorded runs
+
+    :param sizes: synthetic roster sizes
+    :param replay_paths: recordings made with `set_lineup.py --record`
+    :return: a list of dicts with the keys source, league, players, stage and seconds
+    """
+    results = []
+
+    def add(source, league, timings):
+        players = timings.pop("players")
+        for stage, seconds in timings.items():
+            results.append({"source": source, "league": league, "players": players,
+                            "stage": stage, "seconds": seconds})
+
+    for size in sizes:
+        with synthetic_api(synthetic_roster(size, names=projected_names(size))):
+            add("synthetic", "398.l.1", bench_pipeline("398.l.1", values, repeat))
+
+    for path in replay_paths:
+        with fixtures.replay(path, set_lineup) as tape:
+            for league_key in tape.idents("league"):
+                add(path, league_key, bench_pipeline(league_key, values, repeat))
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the lineup optimizer and the whole pipeline")
+    parser.add_argument("--replay", nargs="*", default=[], metavar="PATH",
+                        help="also benchmark recordings made with set_lineup.py --record")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[25, 200, 1000], help="synthetic roster sizes")
+    parser.add_argument("--pool-sizes", nargs="*", type=int, default=[1000, 5000], help="free-agent pool sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of this many runs")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results (JSON)")
+    args = parser.parse_args()
+
+    optimizers = bench_optimizers(repeat=args.repeat)
+    print(optimizers.to_string(float_format="{:.4f}".format))
+
+    pool = bench_free_agents(args.pool_sizes)
+    print(pool.to_string(float_format="{:.4f}".format))
+
+    pipeline = bench_suite(args.sizes, args.replay, repeat=args.repeat)
+    print(pd.DataFrame(pipeline).pivot_table(index=["source", "league", "players"], columns="stage",
+                                             values="seconds").to_string(float_format="{:.4f}".format))
+
+    with open(args.output, "w") as f:
+        f.write(json.dumps({"generated": datetime.now().isoformat(),
+                            "optimizers": optimizers.reset_index().to_dict("records"),
+                            "free_agents": pool.reset_index().to_dict("records"),
+                            "pipeline": pipeline}, indent=2))
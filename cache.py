@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+
+class PlayerDetailsCache:
+    """
+    On-disk cache of Yahoo player details (team, positions, etc.), keyed by player_id
+
+    Player details barely change over a day, so rather than asking Yahoo about every player
+    every run, details are fetched in one batched request for the players that aren't
+    cached (or whose entries are older than the TTL) and saved to disk for the next run.
+
+    One cache can be shared by several Rosters on different threads. Saving merges in whatever
+    other processes have saved since, so no one's entries are lost.
+    """
+
+    def __init__(self, path: str = "player_details.json", ttl: timedelta = timedelta(days=1)):
+        """
+        :param path: where to keep the cache, defaults to ./player_details.json
+        :param ttl: how long a player's details are trusted before asking Yahoo again
+        """
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.entries = self.read()
+
+    def read(self) -> dict:
+        """
+        :return: the entries saved on disk (none, if there's no cache yet)
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def is_fresh(self, player_id) -> bool:
+        """
+        Whether there are cached details for a player that haven't expired
+        """
+        entry = self.entries.get(str(player_id))
+        return entry is not None and time.time() - entry['fetched'] < self.ttl.total_seconds()
+
+    def get(self, league, player_ids, scheduler=None) -> dict:
+        """
+        Details for a bunch of players, only asking Yahoo about the ones that aren't cached
+
+        :param league: a yfa.league.League to fetch missing players from
+        :param player_ids: the Yahoo player IDs to look up
+        :param scheduler: a scheduler.RequestScheduler to make the request through, if any
+        :return: a tuple of a dict of player_id -> player details (as returned by league.player_details())
+            and a dict with the number of cache hits and misses for these players (see stats() for every call's)
+        """
+        player_ids = list(player_ids)
+        with self.lock:
+            missing = [int(pid) for pid in dict.fromkeys(player_ids) if not self.is_fresh(pid)]
+            counts = {"hits": len(player_ids) - len(missing), "misses": len(missing)}
+            self.hits += counts["hits"]
+            self.misses += counts["misses"]
+
+        # (Fetched outside of the lock, so other Rosters aren't held up by this one's request)
+        if missing:
+            fetched = time.time()
+            if scheduler is not None:
+                fetched_details = scheduler.call("league/players", league.player_details, missing)
+            else:
+                fetched_details = league.player_details(missing)
+            with self.lock:
+                for details in fetched_details:
+                    self.entries[str(details['player_id'])] = {'fetched': fetched, 'details': details}
+                self.save()
+
+        with self.lock:
+            return {pid: self.entries[str(pid)]['details'] for pid in player_ids}, counts
+
+    def save(self) -> None:
+        """
+        Writes the cache to disk, keeping any newer entries another process has saved in the meantime
+        """
+        with self.lock:
+            for pid, entry in self.read().items():
+                if pid not in self.entries or entry['fetched'] > self.entries[pid]['fetched']:
+                    self.entries[pid] = entry
+
+            # Write to a temporary file first, so Rosters running at the same time never see half a cache
+            tmp_path = "{}.{}.{}.tmp".format(self.path, os.getpid(), threading.get_ident())
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(self.entries))
+            os.replace(tmp_path, self.path)
+
+    def stats(self) -> dict:
+        """
+        :return: a dict with the number of cache hits and misses so far, for everyone sharing the cache
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# How long each kind of response is good for
+DEFAULT_TTLS = {
+    "gameday": timedelta(minutes=10),  # Probables and game statuses change through the day
+    "positions": timedelta(days=1),
+    "settings": timedelta(days=1),
+    "current_week": timedelta(hours=1),
+    "boxscore": timedelta(days=365),  # Box scores of finished games don't change
+}
+
+
+class ResponseCache:
+    """
+    Two-tier cache for read-only API responses (MLB GameDay, Yahoo league settings, etc.)
+
+    Responses are kept in an in-memory LRU, and optionally pickled to disk so that back-to-back
+    runs can share them. Each endpoint has its own TTL, after which the response is fetched again.
+    """
+
+    def __init__(self, maxsize: int = 256, disk_dir: str = None, ttls: dict = None):
+        """
+        :param maxsize: the most responses to keep in memory
+        :param disk_dir: where to keep responses on disk, or None to only keep them in memory
+        :param ttls: a dict of endpoint -> timedelta, to override DEFAULT_TTLS
+        """
+        self.maxsize = maxsize
+        self.disk_dir = disk_dir
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def disk_path(self, endpoint: str, key) -> str:
+        """
+        Where a response is pickled on disk
+        """
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self.disk_dir, "{}-{}.pickle".format(endpoint, digest))
+
+    def get(self, endpoint: str, key, fetch):
+        """
+        A cached response, or a fresh one from fetch() if there isn't one (or it's expired)
+
+        :param endpoint: what kind of response this is, used to pick the TTL (e.g., 'gameday')
+        :param key: what identifies the response within the endpoint (e.g., the date or league key)
+        :param fetch: a function with no arguments that makes the actual call
+        :return: the response
+        """
+        ttl = self.ttls.get(endpoint, timedelta(0)).total_seconds()
+        now = time.time()
+
+        with self.lock:
+            entry = self.memory.get((endpoint, key))
+            if entry is not None and now - entry[0] < ttl:
+                self.memory.move_to_end((endpoint, key))
+                self.hits += 1
+                return entry[1]
+
+        if self.disk_dir is not None:
+            try:
+                with open(self.disk_path(endpoint, key), "rb") as f:
+                    fetched, stored_key, value = pickle.load(f)
+                if stored_key == key and now - fetched < ttl:
+                    with self.lock:
+                        self.disk_hits += 1
+                        self.remember(endpoint, key, fetched, value)
+                    return value
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+
+        value = fetch()
+        fetched = time.time()
+        with self.lock:
+            self.misses += 1
+            self.remember(endpoint, key, fetched, value)
+        if self.disk_dir is not None:
+            tmp_path = "{}.{}.{}.tmp".format(self.disk_path(endpoint, key), os.getpid(), threading.get_ident())
+            with open(tmp_path, "wb") as f:
+                pickle.dump((fetched, key, value), f)
+            os.replace(tmp_path, self.disk_path(endpoint, key))
+        return value
+
+    def remember(self, endpoint: str, key, fetched: float, value) -> None:
+        """
+        Puts a response in the in-memory LRU, evicting the oldest one if it's full (hold self.lock)
+        """
+        self.memory[(endpoint, key)] = (fetched, value)
+        self.memory.move_to_end((endpoint, key))
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        :return: a dict with the number of memory hits, disk hits and misses so far
+        """
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
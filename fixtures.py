@@ -0,0 +1,212 @@
+import pickle
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+# Calls that return another API object rather than a response
+FACTORIES = {"to_league": "league"}
+
+# Calls that change something on Yahoo. When replaying, these are accepted and ignored
+WRITES = {"change_positions"}
+
+
+def call_key(kind: str, ident, method: str, args: tuple, kwargs: dict) -> tuple:
+    """
+    Identifies a call, so it can be looked up again when replaying
+
+    Dates and times are reduced to the date, since that's all that any of the APIs care about
+    """
+    def normalize(x):
+        if isinstance(x, (date, datetime)):
+            return x.strftime("%Y-%m-%d")
+        if isinstance(x, (list, tuple)):
+            return tuple(normalize(y) for y in x)
+        if isinstance(x, dict):
+            return tuple(sorted((k, normalize(v)) for k, v in x.items()))
+        return x
+    return kind, normalize(ident), method, normalize(args), normalize(kwargs)
+
+
+class Tape:
+    """
+    Every API response recorded during a run, and when the run happened
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.calls = dict()
+        self.recorded_at = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Reads a recording from self.path
+        """
+        with open(self.path, "rb") as f:
+            self.recorded_at, self.calls = pickle.load(f)
+        return self
+
+    def save(self) -> None:
+        """
+        Writes the recording to self.path
+        """
+        with open(self.path, "wb") as f:
+            pickle.dump((self.recorded_at, self.calls), f)
+
+    def idents(self, kind: str) -> list:
+        """
+        :return: the identifiers (e.g., league keys) of every object of a kind that made a call
+        """
+        o = []
+        for recorded_kind, ident, *_ in self.calls:
+            if recorded_kind == kind and ident not in o:
+                o.append(ident)
+        return o
+
+
+class Recording:
+    """
+    Stands in front of a real API object, passing every call through and recording the response
+    """
+
+    def __init__(self, tape: Tape, kind: str, ident, target):
+        object.__setattr__(self, "_tape", tape)
+        object.__setattr__(self, "_kind", kind)
+        object.__setattr__(self, "_ident", ident)
+        object.__setattr__(self, "_target", target)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            o = attr(*args, **kwargs)
+            if name in FACTORIES:
+                return Recording(self._tape, FACTORIES[name], args[0], o)
+            with self._tape.lock:
+                self._tape.calls[call_key(self._kind, self._ident, name, args, kwargs)] = o
+            return o
+        return call
+
+    def __setattr__(self, name, value):
+        # e.g., refresh_token() replacing the OAuth session
+        setattr(self._target, name, value)
+
+
+class Replaying:
+    """
+    Stands in for an API object, answering every call from a Tape
+    """
+
+    def __init__(self, tape: Tape, kind: str, ident):
+        self._tape = tape
+        self._kind = kind
+        self._ident = ident
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            if name in FACTORIES:
+                return Replaying(self._tape, FACTORIES[name], args[0])
+            key = call_key(self._kind, self._ident, name, args, kwargs)
+            if key in self._tape.calls:
+                return self._tape.calls[key]
+            if name in WRITES:
+                return None
+            raise KeyError("Nothing recorded for {}".format(key))
+        return call
+
+
+def frozen_datetime(at: datetime):
+    """
+    A datetime class that thinks it's always 'at'
+    """
+    class FrozenDatetime(datetime):
+        @classmethod
+        def today(cls):
+            return cls.now()
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromtimestamp(at.timestamp(), tz)
+    return FrozenDatetime
+
+
+def patch(module, **replacements) -> dict:
+    """
+    Replaces names in a module, returning the originals so they can be put back
+    """
+    originals = {name: getattr(module, name) for name in replacements}
+    for name, value in replacements.items():
+        setattr(module, name, value)
+    return originals
+
+
+def cold_caches(module) -> dict:
+    """
+    Replacements for a module's caches so that every call actually gets made (and recorded or replayed)
+    """
+    player_details_cache, response_cache = module.PlayerDetailsCache, module.ResponseCache
+    schedule_index = module.schedule_index
+    return {"PlayerDetailsCache": lambda path="player_details.json", *args, **kwargs:
+                player_details_cache(path, ttl=timedelta(0)),
+            "ResponseCache": lambda *args, **kwargs: response_cache(),
+            "schedule_index": lambda path=None, cache=None: schedule_index(None, cache)}
+
+
+@contextmanager
+def record(path: str, module):
+    """
+    Records every Yahoo, MLB GameDay and OAuth response made through a module (e.g., set_lineup)
+    and saves them to path
+
+    ex: with record("fixtures/today.pickle", set_lineup):
+            set_lineup.run_leagues(["Chemical Hydrolysis League"], dry_run=True)
+    """
+    tape = Tape(path)
+    tape.recorded_at = datetime.fromtimestamp(module.datetime.now().timestamp())
+    yfa, mlbgame, update_oauth = module.yfa, module.mlbgame, module.update_oauth
+    originals = patch(
+        module,
+        update_oauth=lambda *args, **kwargs: Recording(tape, "oauth", None, update_oauth(*args, **kwargs)),
+        yfa=SimpleNamespace(
+            game=SimpleNamespace(Game=lambda sc, code: Recording(tape, "game", code, yfa.game.Game(sc, code))),
+            league=SimpleNamespace(League=lambda sc, key: Recording(tape, "league", key, yfa.league.League(sc, key))),
+            team=SimpleNamespace(Team=lambda sc, key: Recording(tape, "team", key, yfa.team.Team(sc, key)))),
+        mlbgame=Recording(tape, "mlbgame", None, mlbgame),
+        **cold_caches(module))
+    try:
+        yield tape
+    finally:
+        patch(module, **originals)
+        tape.save()
+
+
+@contextmanager
+def replay(path: str, module):
+    """
+    Answers every Yahoo, MLB GameDay and OAuth call made through a module from a recording,
+    as if it were still the moment it was recorded. Nothing goes over the network.
+
+    ex: with replay("fixtures/today.pickle", set_lineup):
+            set_lineup.run_leagues(["Chemical Hydrolysis League"])
+    """
+    tape = Tape(path).load()
+    originals = patch(
+        module,
+        datetime=frozen_datetime(tape.recorded_at),
+        update_oauth=lambda *args, **kwargs: Replaying(tape, "oauth", None),
+        yfa=SimpleNamespace(
+            game=SimpleNamespace(Game=lambda sc, code: Replaying(tape, "game", code)),
+            league=SimpleNamespace(League=lambda sc, key: Replaying(tape, "league", key)),
+            team=SimpleNamespace(Team=lambda sc, key: Replaying(tape, "team", key))),
+        mlbgame=Replaying(tape, "mlbgame", None),
+        **cold_caches(module))
+    try:
+        yield tape
+    finally:
+        patch(module, **originals)
@@ -0,0 +1,232 @@
+import argparse
+import contextvars
+import heapq
+import logging
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from set_lineup import (Roster, Assignment, INACTIVE_POSITIONS, blend_values, eligibility_matrix, find_league_key,
+                        lineup_slots, slot_weights, stat_values, update_oauth)
+
+# The most players Yahoo will return stats for in one request
+PAGE_SIZE = 25
+
+# Positions that every batter (or every pitcher) is eligible for, so scanning them would only turn up the same
+# players again
+AGGREGATE_POSITIONS = ("Util", "P", "BN") + INACTIVE_POSITIONS
+
+
+def free_agent_page(league, position: str, start: int, scheduler=None) -> list:
+    """
+    One page of the free agents at a position, straight from Yahoo
+
+    league.free_agents() fetches every page for a position before returning any of them (and keeps them
+    for as long as the league is around), so this asks for the page itself, the same way it does.
+
+    :param league: a yfa.league.League
+    :param position: the position, e.g. "C"
+    :param start: how many of the position's free agents come before the page
+    :param scheduler: a scheduler.RequestScheduler to make the request through, if any
+    :return: a list of at most PAGE_SIZE players, as returned by league.free_agents()
+    """
+    def fetch() -> list:
+        page = league.yhandler.get_players_raw(league.league_id, start, 'FA', position=position)
+        return league._players_from_page(page)[1]
+    return fetch() if scheduler is None else scheduler.call("league/players", fetch)
+
+
+def free_agent_pages(league, positions: list, page_size: int = PAGE_SIZE, scheduler=None):
+    """
+    Yields the free agents at each of some positions, a page at a time, as they're fetched from Yahoo.
+    Players who were already seen at an earlier position are skipped.
+
+    The next page is always being fetched while the one before it is being used, and no more than
+    those two pages are held at once.
+
+    :param league: a yfa.league.League
+    :param positions: the positions to look for free agents at, e.g. ["C", "1B", ...]
+    :param page_size: how many players in a page (at most PAGE_SIZE)
+    :param scheduler: a scheduler.RequestScheduler to make the requests through, if any
+    :return: a generator of dataframes, one per page, as returned by league.free_agents()
+    """
+    todo = deque(positions)
+    if not todo:
+        return
+    seen = set()
+    position, start = todo.popleft(), 0
+    with ThreadPoolExecutor(max_workers=1) as fetcher:
+        # (copy_context() so the calls are counted against whoever's scanning)
+        pending = fetcher.submit(contextvars.copy_context().run, free_agent_page, league, position, start, scheduler)
+        while pending is not None:
+            players = pending.result()
+
+            # Ask for the next page before handing this one over. A short page is a position's last
+            if len(players) == PAGE_SIZE:
+                start += len(players)
+            elif todo:
+                position, start = todo.popleft(), 0
+            else:
+                position = None
+            pending = None if position is None else fetcher.submit(contextvars.copy_context().run, free_agent_page,
+                                                                   league, position, start, scheduler)
+
+            players = [player for player in players if player['player_id'] not in seen]
+            seen.update(player['player_id'] for player in players)
+            for first in range(0, len(players), page_size):
+                yield pd.DataFrame(players[first:first + page_size])
+
+
+def value_page(ros: Roster, page: pd.DataFrame) -> pd.Series:
+    """
+    Values a page of free agents the same way (and for "magic", on the same scale) as a team's roster
+
+    :param ros: the team, already valued (see Roster.value_players())
+    :param page: a page from free_agent_pages()
+    :return: a series of values indexed by player_id
+    """
+    page = page.assign(name=page['name'].map(ros.cleanup_name))
+    pids = page['player_id'].astype(int).to_numpy()
+
+    raw = dict()
+    for source in ("season", "lastmonth", "steamer") if ros.values == "magic" else (ros.values,):
+        if source == "steamer":
+            raw[source] = ros.steamer.lookup_players(page)
+        elif source == "projections":
+            raw[source] = ros.projections.lookup_players(page)
+        else:
+            # One batched request per page and source
+            stats = ros.scheduler.call("league/players/stats", ros.league.player_stats, list(pids), req_type=source)
+            raw[source] = stat_values(pd.DataFrame(stats), source)
+    raw = pd.DataFrame({source: values.reindex(pids) for source, values in raw.items()}, index=pids)
+
+    return blend_values(raw, **ros.blend) if ros.values == "magic" else raw[ros.values]
+
+
+def scan_free_agents(ros: Roster, keep: int = 5, workers: int = 4, page_size: int = PAGE_SIZE) -> pd.DataFrame:
+    """
+    Values every free agent in a team's league, and keeps the best few at each position
+
+    Pages of free agents are valued on a pool of worker threads while the next pages are fetched, and
+    only 'keep' players per position are held onto, so memory stays flat however many free agents there are.
+
+    :param ros: the team
+    :param keep: how many free agents to keep at each position
+    :param workers: how many pages to value at once
+    :param page_size: how many players to fetch stats for in one request (at most PAGE_SIZE)
+    :return: a dataframe indexed by player name, with player_id, status, eligible_positions and value
+        columns, of the best free agents
+    """
+    ros.roster  # (Values the roster first, which also works out the scale everyone's valued on)
+    positions = [position for position in ros.positions if position not in AGGREGATE_POSITIONS]
+    best = {position: [] for position in positions}
+
+    def keep_best(page: pd.DataFrame, values: pd.Series) -> None:
+        values = np.nan_to_num(values.reindex(page['player_id'].astype(int)).to_numpy(dtype=float))
+        for player, value in zip(page.to_dict("records"), values):
+            player['value'] = value
+            for position in player['eligible_positions']:
+                if position not in best:
+                    continue
+                heap = best[position]
+                if len(heap) < keep:
+                    heapq.heappush(heap, (value, player['player_id'], player))
+                elif value > heap[0][0]:
+                    heapq.heapreplace(heap, (value, player['player_id'], player))
+
+    with ros.metrics.stage("free_agents"):
+        ros.logger.info("Scanning free agents at {}...".format(", ".join(positions)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for page in free_agent_pages(ros.league, positions, page_size, ros.scheduler):
+                # (copy_context() so the calls are counted against the Roster's metrics)
+                pending.append((page, pool.submit(contextvars.copy_context().run, value_page, ros, page)))
+                # Don't get more than a couple of pages ahead of the workers
+                if len(pending) >= 2 * workers:
+                    page, values = pending.popleft()
+                    keep_best(page, values.result())
+            while pending:
+                page, values = pending.popleft()
+                keep_best(page, values.result())
+
+    players = {player_id: player for heap in best.values() for _, player_id, player in heap}
+    o = pd.DataFrame(list(players.values()), columns=["player_id", "name", "status", "eligible_positions", "value"])
+    o['name'] = o['name'].map(ros.cleanup_name)
+    return o.set_index('name').sort_values('value', ascending=False)
+
+
+def best_swaps(ros: Roster, candidates: pd.DataFrame, top: int = 10) -> pd.DataFrame:
+    """
+    Finds the add/drop swaps that would most improve a team's lineup (the best drop for each player added)
+
+    A pickup is for more than one day, so lineups are compared at full strength: everyone who
+    isn't on the IL/NA lists counts as playing. Each swap is tried by repairing the optimal lineup
+    (see Assignment.update()) rather than solving it again.
+
+    :param ros: the team
+    :param candidates: players to add, e.g. from scan_free_agents()
+    :param top: how many swaps to report
+    :return: a dataframe with the columns add, add_player_id, drop, drop_player_id, slots_filled
+        (how many more lineup slots, not counting IL/NA ones, get filled) and gain (how much more value the lineup has),
+        best first
+    """
+    roster, positions = ros.roster, ros.positions
+    slots = lineup_slots(positions)['pos'].to_numpy()
+    inactive = np.isin(slots, INACTIVE_POSITIONS)
+
+    players = pd.concat([roster[['player_id', 'status', 'eligible_positions', 'value']],
+                         candidates[['player_id', 'status', 'eligible_positions', 'value']]])
+    n_roster = len(roster)
+    values = np.nan_to_num(players['value'].to_numpy(dtype=float))
+    is_playing = np.where(players['status'].isin(["IL", "NA"]).to_numpy(), -1, 1)
+    eligible = eligibility_matrix(players['eligible_positions'].reset_index(drop=True), positions)[slots]
+    bonus = 2 * np.abs(values).sum() + 1
+    weights = slot_weights(eligible.to_numpy().T, inactive, is_playing, values, bonus)
+
+    # Everyone on the roster is in, none of the candidates are, and there's an "Empty" placeholder for each slot
+    current = np.hstack([weights[:, :n_roster], np.zeros((len(slots), len(players) - n_roster + len(slots)))])
+    assignment = Assignment(current)
+
+    def score() -> tuple:
+        # Only lineup slots count as filled: an IL/NA slot filled by an injured pickup doesn't help the lineup
+        paired = current[np.arange(len(slots)), assignment.matching()]
+        return int((paired[~inactive] > 0).sum()), float((paired[paired > 0] - bonus).sum())
+
+    base_filled, base_value = score()
+    o = []
+    for add in range(n_roster, len(players)):
+        for drop in range(n_roster):
+            swap = [drop, add]
+            current[:, swap] = np.column_stack([np.zeros(len(slots)), weights[:, add]])
+            assignment.update(swap, current[:, swap])
+            filled, value = score()
+            o.append({"add": players.index[add], "add_player_id": players['player_id'].iloc[add],
+                      "drop": players.index[drop], "drop_player_id": players['player_id'].iloc[drop],
+                      "slots_filled": filled - base_filled, "gain": value - base_value})
+            # Put things back for the next swap
+            current[:, swap] = np.column_stack([weights[:, drop], np.zeros(len(slots))])
+            assignment.update(swap, current[:, swap])
+
+    o = pd.DataFrame(o, columns=["add", "add_player_id", "drop", "drop_player_id", "slots_filled", "gain"])
+    o = o[(o['slots_filled'] > 0) | ((o['slots_filled'] == 0) & (o['gain'] > 0))]
+    o = o.sort_values(["slots_filled", "gain"], ascending=False).drop_duplicates("add")  # (Best drop for each add)
+    return o.head(top).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the free agents that would most improve a team's lineup")
+    parser.add_argument("league", nargs="?", default="Chemical Hydrolysis League",
+                        help="league name or key (e.g., 398.l.12345)")
+    parser.add_argument("--values", default="magic", help="how to value players (default: magic)")
+    parser.add_argument("--top", type=int, default=10, help="how many swaps to report")
+    parser.add_argument("--keep", type=int, default=5, help="how many free agents to consider at each position")
+    parser.add_argument("--workers", type=int, default=4, help="how many pages of free agents to value at once")
+    args = parser.parse_args()
+
+    oauth = update_oauth()
+    league_key = args.league if re.fullmatch(r"\d+\.l\.\d+", args.league) else find_league_key(oauth, 'mlb', args.league)
+    ros = Roster(league_key, values=args.values, oauth=oauth, lazy=True)
+    logging.getLogger('yahoo-fantasy').info("Scanning free agents for {}".format(league_key))
+    swaps = best_swaps(ros, scan_free_agents(ros, keep=args.keep, workers=args.workers), top=args.top)
+    print(swaps.to_string(float_format="{:.2f}".format) if len(swaps) else "No swaps would improve the lineup")
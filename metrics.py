@@ -0,0 +1,156 @@
+import contextvars
+import functools
+import json
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# The Metrics that remote calls are counted against, set while a stage is running
+CURRENT = contextvars.ContextVar("metrics", default=None)
+
+# The stage that's running at the moment
+FRAME = contextvars.ContextVar("stage", default=None)
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Boils a Yahoo Fantasy API URL down to the kind of call it is
+
+    ex: endpoint_name(".../fantasy/v2/league/398.l.1/players;player_keys=398.p.1/stats;type=season")
+        -> "league/players/stats"
+    """
+    path = url.split("/fantasy/v2/")[-1].split("?")[0]
+    parts = [part.split(";")[0] for part in path.split("/")]
+    return "/".join(part for part in parts if part and not re.match(r"^[\w]+\.[lpt]\.|^\d", part))
+
+
+def staged(name: str):
+    """
+    Decorates a method so that it runs as a stage of self.metrics
+
+    ex: @staged("optimize_lineup")
+        def optimize_lineup(self): ...
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return f(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_call(endpoint: str, nbytes: int = 0, retry: bool = False) -> None:
+    """
+    Counts a remote call against whichever Metrics is collecting at the moment (if any)
+
+    :param endpoint: the kind of call, e.g. "league/players/stats" or "gameday/day"
+    :param nbytes: how many bytes came back
+    :param retry: whether this was a failed attempt that will be retried
+    """
+    metrics = CURRENT.get()
+    if metrics is not None:
+        metrics.calls[endpoint] += 1
+        metrics.bytes[endpoint] += nbytes
+        if retry:
+            metrics.retries[endpoint] += 1
+
+
+def record_retry(endpoint: str) -> None:
+    """
+    Counts a failed call that's going to be tried again (the call itself was already counted when it was made)
+
+    :param endpoint: the kind of call, e.g. "league/players/stats"
+    """
+    metrics = CURRENT.get()
+    if metrics is not None:
+        metrics.retries[endpoint] += 1
+
+
+def count_response(response, *args, **kwargs) -> None:
+    """
+    A requests response hook that counts every Yahoo call made through a session
+    """
+    # yfa refreshes the token and tries again when it gets a 401 back
+    record_call(endpoint_name(response.url), len(response.content), retry=response.status_code == 401)
+
+
+def watch(session) -> None:
+    """
+    Counts every call made through a requests session (e.g., OAuth2.session). Safe to call more than once.
+    """
+    hooks = getattr(session, "hooks", None)
+    if hooks is not None and count_response not in hooks["response"]:
+        hooks["response"].append(count_response)
+
+
+class Metrics:
+    """
+    How long each stage of a run took, and how many remote calls (and bytes) each kind of call made
+
+    Calls are only counted while a stage is running (see stage()), and when disabled nothing is
+    counted or timed at all.
+    """
+
+    def __init__(self, enabled: bool = True, **labels):
+        """
+        :param enabled: whether to collect anything
+        :param labels: anything else to include in the summary, e.g. league_key="398.l.12345"
+        """
+        self.enabled = enabled
+        self.labels = labels
+        self.stages = Counter()
+        self.calls = Counter()
+        self.bytes = Counter()
+        self.retries = Counter()
+
+    def stage(self, name: str):
+        """
+        Times a stage, and counts any remote calls made during it against these Metrics
+
+        ex: with self.metrics.stage("optimize_lineup"):
+                ...
+        """
+        return self.timed(name) if self.enabled else nullcontext()
+
+    @contextmanager
+    def timed(self, name: str):
+        """
+        Does the work for stage() when enabled
+        """
+        # Stages can start inside other stages (e.g., a lazy Roster fetching the league halfway
+        # through fetching the roster), so each stage only counts its own time, not its children's
+        parent = FRAME.get()
+        frame = {"children": 0.0}
+        token, frame_token = CURRENT.set(self), FRAME.set(frame)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] += elapsed - frame["children"]
+            if parent is not None:
+                parent["children"] += elapsed
+            FRAME.reset(frame_token)
+            CURRENT.reset(token)
+
+    def summary(self) -> dict:
+        """
+        :return: everything collected so far, as a JSON-friendly dict
+        """
+        return dict(self.labels,
+                    stages=dict(self.stages),
+                    calls=dict(self.calls),
+                    bytes=dict(self.bytes),
+                    retries=dict(self.retries),
+                    total_calls=sum(self.calls.values()),
+                    total_bytes=sum(self.bytes.values()),
+                    total_seconds=sum(self.stages.values()))
+
+    def to_json(self, path: str) -> None:
+        """
+        Writes summary() to a file
+        """
+        with open(path, "w") as f:
+            f.write(json.dumps(self.summary(), indent=2))
@@ -0,0 +1,306 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# The columns a projection CSV can have (by these names, or mapped to them, see ProjectionStore)
+NAME_COL, TEAM_COL, PLAYING_TIME_COLS = "Name", "Team", ("AB", "IP")
+
+
+def standardize(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """
+    Puts values on a common scale within each group (e.g., batters and pitchers), in one pass: how far each value is
+    from its group's median, in median absolute deviations (or mean absolute deviations, or plain units, if
+    most of the group is bunched up on the median)
+
+    :param values: the values (NaN for unknown)
+    :param groups: which group each value is in
+    :return: the standardized values, in the same order
+    """
+    values = pd.Series(values, dtype=float)
+    groups = pd.Series(groups)
+    deviation = (values - values.groupby(groups).transform("median"))
+    spread = deviation.abs().groupby(groups).transform("median")
+    spread = spread.where(spread > 0, deviation.abs().groupby(groups).transform("mean"))
+    return (deviation / spread.where(spread > 0, 1.0)).to_numpy()
+
+
+class ProjectionStore:
+    """
+    Projected player values, compiled from projection CSVs into memory-mapped NumPy arrays
+
+    Reading and cleaning up the raw CSVs takes a while, so it's only done when one of them
+    has changed since the last compile. After that, looking up a roster is one dict lookup
+    per player, using a prebuilt index from cleaned-up name to rows.
+
+    Players are matched to their projections once, by name (using their team and whether they're
+    a batter or a pitcher to tell apart players with the same name), and the match is saved in a
+    second index from Yahoo player_id to row. From then on they're looked up by player_id.
+
+    Several stores (on different threads, or in different processes) can use the same compiled_dir.
+    Checking whether it's stale, compiling it and loading it all happen under a lock on the directory,
+    and a compile is written to a temporary directory that's swapped in once it's complete, so no
+    one ever reads half of one.
+    """
+
+    def __init__(self, paths, compiled_dir: str, normalize=None, value_col: str = "WAR", unknown: float = 0.1,
+                 position_types=None, team_abbrevs: dict = None, columns: dict = None, standardized: bool = False):
+        """
+        :param paths: the projection CSVs. Each should have at least 'Name' and value_col columns
+        :param compiled_dir: where to keep the compiled arrays and indexes
+        :param normalize: function used to clean up names before indexing (e.g., Roster.cleanup_name)
+        :param value_col: the column that represents a player's value
+        :param unknown: the value used when a player's projection is missing
+        :param position_types: the Yahoo position type of the players in each CSV (e.g., ['B', 'P'])
+        :param team_abbrevs: a dict of the projections' team names -> Yahoo team abbreviations
+        :param columns: a dict of column names (Name, Team, AB, IP and value_col) -> what the CSVs call them,
+            for CSVs that don't use those names, e.g. {"Name": "PlayerName", "WAR": "fWAR"}
+        :param standardized: whether to put the values on a common scale (see standardize()) for each
+            position type, so they can be blended with other projection systems
+        """
+        self.paths = list(paths)
+        self.compiled_dir = compiled_dir
+        self.normalize = normalize if normalize is not None else (lambda x: x)
+        self.value_col = value_col
+        self.unknown = unknown
+        self.position_types = list(position_types) if position_types is not None else [""] * len(self.paths)
+        self.team_abbrevs = team_abbrevs if team_abbrevs is not None else dict()
+        self.columns = columns if columns is not None else dict()
+        self.standardized = standardized
+        self.index = None
+        self.player_ids = None
+        self.values = None
+        self.playing_time = None
+        self.teams = None
+        self.types = None
+        self.sources = None
+        self.lock = threading.RLock()
+
+    def source_mtimes(self) -> dict:
+        """
+        :return: a dict of CSV path -> last modified time
+        """
+        return {path: os.path.getmtime(path) for path in self.paths}
+
+    def signature(self) -> dict:
+        """
+        Everything the compiled store depends on: the CSVs' last modified times and how they're read
+        """
+        return {"sources": self.source_mtimes(), "value_col": self.value_col, "columns": self.columns,
+                "standardized": self.standardized}
+
+    def read_csv(self, path: str) -> pd.DataFrame:
+        """
+        Reads only the columns that are needed from a CSV, renamed to the usual names
+
+        :return: a dataframe with a Name column, a value_col column, and Team, AB and IP columns if the CSV has them
+        """
+        wanted = {self.columns.get(col, col): col for col in (NAME_COL, TEAM_COL, self.value_col) + PLAYING_TIME_COLS}
+        return pd.read_csv(path, usecols=lambda col: col in wanted).rename(columns=wanted)
+
+    def compiled_path(self, name: str) -> str:
+        return os.path.join(self.compiled_dir, name)
+
+    @contextmanager
+    def file_lock(self):
+        """
+        Holds an exclusive lock on compiled_dir (well, on a file next to it) across threads and processes
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.compiled_dir)), exist_ok=True)
+        with self.lock, open(self.compiled_dir.rstrip("/") + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def compile(self) -> None:
+        """
+        Reads the CSVs and writes the compiled arrays, index and source mtimes to compiled_dir
+        (hold file_lock())
+        """
+        player_values = pd.concat([self.read_csv(path).assign(position_type=position_type)
+                                   for path, position_type in zip(self.paths, self.position_types)],
+                                  ignore_index=True)
+
+        # Players with the same name are all kept, and told apart when they're looked up.
+        # When that doesn't settle it, the player with the most projected ABs or IPs wins
+        playing_time = np.zeros(len(player_values))
+        for col in PLAYING_TIME_COLS:
+            if col in player_values.columns:
+                playing_time += player_values[col].fillna(0).to_numpy(dtype=float)
+        names = player_values[NAME_COL].map(self.normalize).tolist()
+        values = player_values[self.value_col].to_numpy(dtype=float)
+        if self.standardized:
+            values = standardize(values, player_values['position_type'].to_numpy())
+        values = np.where(np.isnan(values), self.unknown, values)
+        teams = player_values.get(TEAM_COL, pd.Series("", index=player_values.index)).map(self.team_abbrevs)
+
+        index = dict()
+        for row, name in enumerate(names):
+            index.setdefault(name, []).append(row)
+
+        # Write everything to a temporary directory first, and only then swap it in for the old one
+        tmp_dir = "{}.{}.{}.tmp".format(self.compiled_dir.rstrip("/"), os.getpid(), threading.get_ident())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "values.npy"), values)
+        np.save(os.path.join(tmp_dir, "playing_time.npy"), playing_time)
+        np.save(os.path.join(tmp_dir, "teams.npy"), teams.fillna("").to_numpy(dtype=str))
+        np.save(os.path.join(tmp_dir, "types.npy"), player_values['position_type'].to_numpy(dtype=str))
+        with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+            f.write(json.dumps(index))
+        with open(os.path.join(tmp_dir, "player_ids.json"), "w") as f:
+            f.write(json.dumps(dict()))  # Rows have moved, so every player has to be matched again
+        with open(os.path.join(tmp_dir, "sources.json"), "w") as f:
+            f.write(json.dumps(self.signature()))
+
+        # A directory can't be replaced while it has files in it, so the old one is moved out of the way first.
+        # (Whoever has the old arrays memory-mapped keeps them until they load again)
+        old_dir = tmp_dir + ".old"
+        if os.path.exists(self.compiled_dir):
+            os.replace(self.compiled_dir, old_dir)
+        os.replace(tmp_dir, self.compiled_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def load(self) -> None:
+        """
+        Loads the compiled store, compiling it first if it's missing or any CSV has changed
+        """
+        sources = self.signature()
+        with self.lock:
+            if self.values is not None and sources == self.sources:
+                return
+            with self.file_lock():
+                if self.read_signature() != sources:
+                    self.compile()
+                with open(self.compiled_path("index.json")) as f:
+                    self.index = json.load(f)
+                with open(self.compiled_path("player_ids.json")) as f:
+                    self.player_ids = json.load(f)
+                self.values = np.load(self.compiled_path("values.npy"), mmap_mode='r')
+                self.playing_time = np.load(self.compiled_path("playing_time.npy"), mmap_mode='r')
+                self.teams = np.load(self.compiled_path("teams.npy"))
+                self.types = np.load(self.compiled_path("types.npy"))
+                self.sources = sources
+
+    def read_signature(self) -> dict:
+        """
+        :return: the signature() compiled_dir was compiled with (None, if it hasn't been)
+        """
+        try:
+            with open(self.compiled_path("sources.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def match(self, name: str, team: str = "", position_type: str = "") -> int:
+        """
+        Finds a player's row by name, using their team and position type to break ties
+
+        :return: the row, or -1 if there's no projection with that name
+        """
+        rows = self.index.get(name, [])
+        if len(rows) <= 1:
+            return rows[0] if rows else -1
+        return max(rows, key=lambda row: (self.types[row] == position_type,
+                                          self.teams[row] == team,
+                                          self.playing_time[row]))
+
+    def lookup(self, names) -> np.ndarray:
+        """
+        Projected values for a list of (already cleaned up) names
+
+        :param names: player names, e.g. self.players['name']
+        :return: an array of values in the same order as names, with 'unknown' for missing players
+        """
+        self.load()
+        rows = [self.match(name) for name in names]
+        return np.array([self.values[row] if row >= 0 else self.unknown for row in rows], dtype=float)
+
+    def lookup_players(self, players: pd.DataFrame) -> pd.Series:
+        """
+        Projected values for a set of Yahoo players, matched by player_id
+
+        :param players: a dataframe with player_id and name columns (and, to tell apart players
+            with the same name, team and position_type)
+        :return: a series of values indexed by player_id, with 'unknown' for missing players
+        """
+        teams = players['team'] if 'team' in players.columns else [""] * len(players)
+        types = players['position_type'] if 'position_type' in players.columns else [""] * len(players)
+
+        rows = []
+        matched = False
+        with self.lock:  # (Pages of free agents are looked up on several threads at once)
+            self.load()
+            for pid, name, team, position_type in zip(players['player_id'], players['name'], teams, types):
+                # Matches are kept with the name they were made for, in case Yahoo renames a player
+                matched_name, row = self.player_ids.get(str(pid), (None, -1))
+                if matched_name != name:
+                    row = self.match(name, team, position_type)
+                    self.player_ids[str(pid)] = (name, row)
+                    matched = True
+                rows.append(row)
+            if matched:
+                self.save_player_ids()
+
+        return pd.Series([self.values[row] if row >= 0 else self.unknown for row in rows],
+                         index=players['player_id'].to_numpy(), dtype=float)
+
+    def save_player_ids(self) -> None:
+        """
+        Writes the player_id index to compiled_dir, unless it's been compiled again since it was loaded
+        (its rows would be wrong for the new compile)
+        """
+        with self.file_lock():
+            if self.read_signature() != self.sources:
+                return
+            tmp_path = "{}.{}.{}.tmp".format(self.compiled_path("player_ids.json"), os.getpid(), threading.get_ident())
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(self.player_ids))
+            os.replace(tmp_path, self.compiled_path("player_ids.json"))
+
+
+class ProjectionBlend:
+    """
+    Several projection systems blended into one value per player
+
+    Each system is its own ProjectionStore, with its values standardized (see standardize()) so that systems
+    that measure value differently can be averaged. Since each store is only compiled again when its own CSVs
+    change, updating one system in-season only reprocesses that system.
+    """
+
+    def __init__(self, stores: dict, weights: dict = None, unknown: float = 0.0, center: float = 3):
+        """
+        :param stores: a dict of name -> ProjectionStore (standardized, with unknown=NaN, so that a system
+            without a projection for a player is left out of that player's blend rather than counted)
+        :param weights: a dict of name -> how much each system counts (defaults to all the same)
+        :param unknown: the standardized value used for players none of the systems have a projection for
+            (0 is the median projected player)
+        :param center: added to every blended value, like set_lineup.blend_values(), so that a player who's
+            playing is worth more than one who isn't unless he's more than 'center' spreads below the median
+        """
+        self.stores = dict(stores)
+        self.weights = {name: 1.0 for name in self.stores} if weights is None else dict(weights)
+        self.unknown = unknown
+        self.center = center
+
+    def lookup_players(self, players: pd.DataFrame) -> pd.Series:
+        """
+        Blended values for a set of Yahoo players: the weighted average of the systems that have a projection
+        for each player
+
+        :param players: a dataframe with player_id and name columns (see ProjectionStore.lookup_players())
+        :return: a series of values indexed by player_id, with 'unknown' (plus 'center') for players no system has
+        """
+        values = pd.DataFrame({name: store.lookup_players(players).to_numpy() for name, store in self.stores.items()},
+                              index=players['player_id'].to_numpy())
+        weights = np.array([self.weights.get(name, 0.0) for name in values.columns])
+        known = values.notna().to_numpy()
+        total = (known * weights).sum(axis=1)
+        blended = (values.fillna(0).to_numpy() * weights).sum(axis=1) / np.where(total > 0, total, 1)
+        return pd.Series(np.where(total > 0, blended, self.unknown) + self.center, index=values.index, dtype=float)
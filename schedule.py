@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+
+def day_key(when) -> str:
+    """
+    :param when: a date or datetime
+    :return: the day as an ISO date, e.g. "2020-08-15"
+    """
+    return (when.date() if isinstance(when, datetime) else when).isoformat()
+
+
+class ScheduleIndex:
+    """
+    The season's MLB schedule, indexed by day and team, so "who plays on day D", "when's the first pitch on
+    day D" and "who are the probable starters on day D" are dict lookups rather than GameDay calls
+
+    The schedule is fetched a day at a time (all at once with build(), or as days are asked about) and saved
+    to disk, so it's only fetched once a season. Only the days coming up soon, whose probables and game times
+    are still changing, are fetched again, and then only every 'refresh_after'.
+    """
+
+    def __init__(self, fetch, path: str = None, abbrevs: dict = None, normalize=None, horizon: int = 1,
+                 refresh_after: timedelta = timedelta(minutes=10), clock=datetime.now):
+        """
+        :param fetch: a function from a day (as a datetime) to a list of GameDay games (e.g., set_lineup.fetch_games)
+        :param path: where to keep the index (JSON), or None to only keep it in memory
+        :param abbrevs: a dict of GameDay team names -> Yahoo team abbreviations (e.g., set_lineup.TEAM_ABBREVS)
+        :param normalize: function used to clean up the probables' names (e.g., Roster.cleanup_name)
+        :param horizon: how many days after today are still "coming up soon" (today always is)
+        :param refresh_after: how long the days coming up soon are trusted before fetching them again
+        :param clock: what time it is (a function, so it can be frozen when replaying)
+        """
+        self.fetch = fetch
+        self.path = path
+        self.abbrevs = abbrevs if abbrevs is not None else dict()
+        self.normalize = normalize if normalize is not None else (lambda x: x)
+        self.horizon = horizon
+        self.refresh_after = refresh_after
+        self.clock = clock
+        self.days = dict()  # day -> {"fetched": ..., "games": [...]}, as saved
+        self.index = dict()  # day -> what the queries below need, worked out from self.days
+        self.lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self.days = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.days = dict()
+            for key, entry in self.days.items():
+                self.index[key] = self.index_day(entry["games"])
+
+    def game_record(self, game) -> dict:
+        """
+        What's kept of a GameDay game
+        """
+        return {"home": self.abbrevs.get(game.home_team, game.home_team),
+                "away": self.abbrevs.get(game.away_team, game.away_team),
+                "start": game.date.isoformat(),
+                "status": game.game_status,
+                "p_home": self.normalize(game.p_pitcher_home) if len(game.p_pitcher_home) > 2 else "",
+                "p_away": self.normalize(game.p_pitcher_away) if len(game.p_pitcher_away) > 2 else ""}
+
+    @staticmethod
+    def index_day(games: list) -> dict:
+        """
+        Works out everything the queries need for a day, once
+
+        :param games: the day's games, from game_record()
+        """
+        # Like Roster.fetch_probables() always has, only games that haven't started count
+        pending = [game for game in games if game["status"] == "PRE_GAME"]
+        teams = [team for game in pending for team in (game["home"], game["away"])]
+        by_team = dict()
+        for game in games:
+            by_team.setdefault(game["home"], []).append(game)
+            by_team.setdefault(game["away"], []).append(game)
+        return {"first_pitch": min((datetime.fromisoformat(game["start"]).hour for game in games), default=24),
+                "probables": {"pitchers": [name for game in pending for name in (game["p_home"], game["p_away"])
+                                           if name],
+                              "teams": list(dict.fromkeys(teams))},
+                "by_team": by_team}
+
+    def is_near(self, when) -> bool:
+        """
+        Whether a day is coming up soon enough that its probables and game times are still changing
+        """
+        days = (date.fromisoformat(day_key(when)) - self.clock().date()).days
+        return 0 <= days <= self.horizon
+
+    def day(self, when) -> dict:
+        """
+        Everything indexed for a day, fetching it first if it isn't indexed (or is coming up soon and is stale)
+        """
+        key = day_key(when)
+        entry = self.days.get(key)
+        if entry is None or (self.is_near(when) and
+                             self.clock() - datetime.fromisoformat(entry["fetched"]) > self.refresh_after):
+            self.add(when, self.fetch(datetime.fromisoformat(key)))
+        return self.index[key]
+
+    def add(self, when, games: list, save: bool = True) -> None:
+        """
+        Indexes a day's games (replacing whatever was indexed for it)
+
+        :param when: the day
+        :param games: the day's GameDay games
+        :param save: whether to write the index to disk afterwards
+        """
+        key = day_key(when)
+        entry = {"fetched": self.clock().isoformat(), "games": [self.game_record(game) for game in games]}
+        with self.lock:
+            self.days[key] = entry
+            self.index[key] = self.index_day(entry["games"])
+        if save:
+            self.save()
+
+    def build(self, start, end, workers: int = 8) -> None:
+        """
+        Fetches and indexes every day from start to end (inclusive), e.g. a whole season
+
+        :param workers: how many days to fetch at once
+        """
+        start, end = datetime.fromisoformat(day_key(start)), datetime.fromisoformat(day_key(end))
+        days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for when, games in zip(days, pool.map(self.fetch, days)):
+                self.add(when, games, save=False)
+        self.save()
+
+    def save(self) -> None:
+        """
+        Writes the index to disk (if it has a path)
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            text = json.dumps(self.days)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = "{}.{}.{}.tmp".format(self.path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    def first_pitch(self, when) -> int:
+        """
+        :return: the hour (Eastern) of the day's first game, or 24 if there are no games
+        """
+        return self.day(when)["first_pitch"]
+
+    def teams(self, when) -> list:
+        """
+        :return: the (Yahoo abbreviations of the) teams with a game on the day that hasn't started
+        """
+        return self.day(when)["probables"]["teams"]
+
+    def probables(self, when) -> dict:
+        """
+        :return: a dict with keys "pitchers" containing the day's probable starters (cleaned up)
+            and "teams" containing the teams that are playing, like Roster.fetch_probables()
+        """
+        probables = self.day(when)["probables"]
+        return {"pitchers": list(probables["pitchers"]), "teams": list(probables["teams"])}
+
+    def games(self, when, team: str) -> list:
+        """
+        :return: a team's games on a day (as saved by game_record()), e.g. to find its start times
+        """
+        return self.day(when)["by_team"].get(team, [])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the season's schedule index from MLB GameDay")
+    parser.add_argument("start", type=date.fromisoformat, help="the first day of the season, e.g. 2020-07-23")
+    parser.add_argument("end", type=date.fromisoformat, help="the last day of the season, e.g. 2020-09-27")
+    parser.add_argument("--output", default="data/schedule.json", help="where to keep the index")
+    parser.add_argument("--workers", type=int, default=8, help="how many days to fetch at once")
+    args = parser.parse_args()
+
+    import set_lineup
+    schedule = set_lineup.schedule_index(args.output)
+    schedule.build(args.start, args.end, workers=args.workers)
+    print("Indexed {} days ({} games) in {}".format(
+        len(schedule.days), sum(len(entry["games"]) for entry in schedule.days.values()), args.output))
@@ -0,0 +1,141 @@
+import logging
+import random
+import threading
+import time
+from metrics import record_retry
+
+# HTTP statuses worth trying again after a while: Yahoo's "Request denied" (999) when it's throttling,
+# rate limiting, and its servers having a bad moment
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504, 999}
+
+# The last response each thread got back (see observe())
+LAST = threading.local()
+
+
+def remember_response(response, *args, **kwargs) -> None:
+    """
+    A requests response hook that remembers the last response's status (and Retry-After), for the thread that made it
+    """
+    LAST.status = response.status_code
+    LAST.retry_after = response.headers.get("Retry-After")
+
+
+def observe(session) -> None:
+    """
+    Lets the scheduler see the status of every call made through a requests session. Safe to call more than once.
+
+    yfa turns a bad response into a bare RuntimeError, so this is how the scheduler tells throttling
+    (worth waiting out) from a bad request (not worth sending again).
+    """
+    hooks = getattr(session, "hooks", None)
+    if hooks is not None and remember_response not in hooks["response"]:
+        hooks["response"].append(remember_response)
+
+
+def is_transient(e: Exception, status: int = None) -> bool:
+    """
+    Whether a failed call is worth trying again
+
+    :param e: what the call raised
+    :param status: the HTTP status of the call's last response, if there was one
+    """
+    if status in TRANSIENT_STATUSES:
+        return True
+    # (Imported here, since only a failure needs it)
+    import requests
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+class RequestScheduler:
+    """
+    Paces and retries every Yahoo call, so several teams can be worked on at once without getting throttled
+
+    Calls are let through at no more than 'rate' per second on average (a token bucket, so short bursts
+    are fine) and no more than 'concurrency' at a time. A call that fails because Yahoo is throttling or
+    briefly down is tried again after an exponentially growing, jittered wait; any other failure is
+    raised straight away.
+
+    Reads can always be tried again. Writes (e.g., change_positions) might have gone through even though
+    the call failed, so they're only sent again once applied() says they haven't.
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 10, concurrency: int = 8, retries: int = 4,
+                 base_delay: float = 0.5, max_delay: float = 30.0):
+        """
+        :param rate: how many calls a second to make, on average
+        :param burst: how many calls can be made at once after a quiet spell
+        :param concurrency: the most calls in flight at once
+        :param retries: how many times to try a failed call again
+        :param base_delay: how long to wait before the first retry, in seconds (doubling for each one after that)
+        :param max_delay: the longest to wait before a retry, in seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.logger = logging.getLogger('yahoo-fantasy')
+
+    def acquire(self) -> None:
+        """
+        Waits for the token bucket to let another call through
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, attempt: int, retry_after: str = None) -> float:
+        """
+        How long to wait before trying a call again: Yahoo's Retry-After if it sent one, otherwise
+        exponential backoff with "full jitter", so threads that failed together don't all come back together
+
+        :param attempt: how many times the call has failed before (0 for the first failure)
+        """
+        try:
+            return min(self.max_delay, float(retry_after))
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, endpoint: str, fn, *args, idempotent: bool = True, applied=None, **kwargs):
+        """
+        Makes a call when the rate limit allows, trying it again if it fails with something transient
+
+        ex: scheduler.call("team/roster", team.roster, day=when)
+            scheduler.call("team/roster/put", team.change_positions, when, payload,
+                           idempotent=False, applied=lambda: ...)
+
+        :param endpoint: the kind of call, for the logs and metrics (e.g., "league/players/stats")
+        :param fn: what to call
+        :param idempotent: whether sending the call twice does no harm
+        :param applied: for calls that aren't idempotent, a function with no arguments that says whether
+            a failed call took effect anyway. If there isn't one, those calls are never tried again
+        :return: whatever fn returns (or None, if a failed write turned out to have taken effect)
+        """
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            LAST.status, LAST.retry_after = None, None
+            try:
+                with self.slots:
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                status, retry_after = LAST.status, LAST.retry_after
+                if attempt == self.retries or not is_transient(e, status) or (not idempotent and applied is None):
+                    raise
+                delay = self.backoff(attempt, retry_after)
+                record_retry(endpoint)
+                self.logger.warning("{} failed ({}), trying again in {:.1f}s".format(endpoint, status or repr(e), delay))
+                time.sleep(delay)
+                if not idempotent and applied():
+                    self.logger.info("{} went through after all".format(endpoint))
+                    return None
@@ -1,17 +1,82 @@
+from __future__ import annotations
+import argparse
+import contextlib
+import contextvars
 import csv
+import importlib.util
 import json
-from yahoo_oauth import OAuth2
-import mlbgame
-import yahoo_fantasy_api as yfa
-import pandas as pd
-from unidecode import unidecode
+import os
+import re
+import sys
+import threading
+import time
 from datetime import datetime, timedelta
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
 
-def find_league_key(oauth: OAuth2, code: str, league_name: str = None) -> str:
+def lazy_import(name: str):
+    """
+    Imports a module the first time one of its attributes is used, rather than right away.
+    pandas, numpy and friends take a while to import, and plenty of runs never need them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class lazy_property:
+    """
+    Like functools.cached_property: works the attribute out the first time it's used, and keeps it in the
+    instance's __dict__ (so `del` or `__dict__.pop()` makes it be worked out again).
+
+    cached_property (up to Python 3.11) holds one lock per attribute for every instance of the class, so
+    Rosters on different threads wait on each other's rosters, stats, etc. Here each instance has its own locks.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        cache = instance.__dict__
+        if self.name in cache:
+            return cache[self.name]
+        # (One lock per attribute, so a worker thread can work out one attribute while another is being worked out)
+        lock = cache.setdefault("_lazy_locks", dict()).setdefault(self.name, threading.RLock())
+        with lock:
+            if self.name not in cache:
+                cache[self.name] = self.func(instance)
+            return cache[self.name]
+
+
+yahoo_oauth = lazy_import("yahoo_oauth")
+mlbgame = lazy_import("mlbgame")
+yfa = lazy_import("yahoo_fantasy_api")
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+unidecode = lazy_import("unidecode")
+
+from auth import token_manager  # noqa: E402
+from cache import PlayerDetailsCache, ResponseCache  # noqa: E402
+from metrics import Metrics, record_call, staged, watch  # noqa: E402
+from schedule import ScheduleIndex  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+
+
+def find_league_key(oauth: yahoo_oauth.OAuth2, code: str, league_name: str = None, cache: ResponseCache = None) -> str:
     """
     Get the key of a league by name
 
@@ -19,6 +84,7 @@ def find_league_key(oauth: OAuth2, code: str, league_name: str = None) -> str:
     code - Sports code for the league you're looking for (e.g., 'mlb' or 'nfl')
     league_name - The name of the league you're looking for. If no league name is
              passed, will print the names of the leagues and return an empty dictionary
+    cache - Where to keep league settings between calls (optional)
 
     ex: get_league_details(oauth, code="nfl")
     ex: get_league_details(oauth, code="mlb", league_name="Neato Keeper League")
@@ -27,42 +93,79 @@ def find_league_key(oauth: OAuth2, code: str, league_name: str = None) -> str:
     this_year = datetime.today().year
     game = yfa.game.Game(oauth, code)
     league_ids = game.league_ids(this_year)
+    cache = ResponseCache() if cache is None else cache
 
     if league_name is None:
         for league_id in league_ids:
             league = game.to_league(league_id)
-            details = league.settings()
+            details = cache.get("settings", league_id, league.settings)
             print('League: {name} // Key: {league_key}'.format(**details))
-            return ""
+        return ""
     else:
         for league_id in league_ids:
             league = game.to_league(league_id)
-            details = league.settings()
+            details = cache.get("settings", league_id, league.settings)
             if details['name'] == league_name:
                 return details['league_key']
-            print("Can't find league '{}'".format(league_name))
-            return ""
+        print("Can't find league '{}'".format(league_name))
+        return ""
+
+
+def fetch_games(when: datetime, cache: ResponseCache = None) -> list:
+    """
+    Gets the games on a given date from MLB GameDay API
+
+    :param when: the date
+    :param cache: where to look for the games before asking GameDay (optional)
+    :return: a list of GameDay games
+    """
+    def fetch():
+        record_call("gameday/day")
+        return mlbgame.day(when.year, when.month, when.day)
+    return fetch() if cache is None else cache.get("gameday", when.date(), fetch)
+
 
+def schedule_index(path: str = None, cache: ResponseCache = None) -> ScheduleIndex:
+    """
+    The season's schedule, indexed by day and team, filled in from MLB GameDay as days are asked about
+    (see schedule.ScheduleIndex)
 
-def earliest_game() -> int:
+    :param path: where to keep the index between runs (optional)
+    :param cache: where to look for games before asking GameDay (optional)
     """
-    Queries the MLB GameDay API for the start time of all of today's games.
+    return ScheduleIndex(lambda when: fetch_games(when, cache), path=path, abbrevs=TEAM_ABBREVS,
+                         normalize=Roster.cleanup_name, clock=lambda: datetime.now())
+
 
-    :return: the hour of the start time of the earliest game today
+def next_wakeup(now: datetime, first_pitch: int, poll: timedelta = timedelta(minutes=30)) -> datetime:
     """
-    when = datetime.today()
-    games = mlbgame.day(when.year, when.month, when.day)
-    start_times = []  # Hour that game starts, Eastern
-    for game in games:
-        start_times.append(game.date.hour)
-    return min(start_times)
+    When to look at the lineups again, when running as a daemon (see run_daemon())
 
+    Until an hour before today's first game, it's today's lineup that's being set, and probables
+    and statuses can change at any time, so look every 'poll'. Always look one last time just before
+    that cutoff. After it, tomorrow's lineup is being set and not much changes, so only look every
+    few polls (and again just after midnight, when tomorrow becomes today).
 
-def update_oauth(path='oauth.json') -> OAuth2:
+    :param now: the current time
+    :param first_pitch: the hour (Eastern) of today's first game, e.g. from ScheduleIndex.first_pitch()
+    :param poll: how often to look while today's lineup can still change
+    :return: the time to wake up
+    """
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    last_call = midnight + timedelta(hours=first_pitch - 1, minutes=-5)
+    if now < last_call:
+        return min(now + poll, last_call)
+    return min(now + 4 * poll, midnight + timedelta(days=1, minutes=1))
+
+
+def update_oauth(path='oauth.json') -> yahoo_oauth.OAuth2:
     """
     Authenticates with Yahoo and creates session context from local secrets file.
     Returns an OAuth2 object for use in future calls
 
+    Everything in a process that uses the same token file gets the same session, and the token
+    is only refreshed once however many processes are using it (see auth.TokenManager)
+
     path - where to save the oauth token, defaults to ./oauth.json
 
     ex: get_oauth()
@@ -71,17 +174,7 @@ def update_oauth(path='oauth.json') -> OAuth2:
 
     logging.getLogger('yahoo_oauth').disabled = True
 
-    try:
-        oauth = OAuth2(None, None, from_file=path)
-        if oauth.token_is_valid():
-            return oauth
-        else:
-            oauth.refresh_access_token()
-            # https://github.com/josuebrunel/yahoo-oauth/issues/55#issuecomment-602217706
-            oauth.session = oauth.oauth.get_session(token=oauth.access_token)
-            # Apparently this is a bug
-            return oauth
-    except FileNotFoundError:
+    if not os.path.exists(path):
         with open('../secrets.csv') as secrets_file:
             reader = csv.reader(secrets_file)
             for row in reader:
@@ -91,12 +184,557 @@ def update_oauth(path='oauth.json') -> OAuth2:
         credentials = {'consumer_key': consumer_key, 'consumer_secret': consumer_secret}
         with open(path, "w") as f:
             f.write(json.dumps(credentials))
-        return OAuth2(None, None, from_file=path)
+    return token_manager(path).get()
+
+# Translate between the names GameDay and the projections use (keys) and the names YF uses (values)
+TEAM_ABBREVS = {
+    "Braves": "Atl",
+    "Marlins": "Mia",
+    "Mets": "NYM",
+    "Phillies": "Phi",
+    "Nationals": "Was",
+
+    "Cubs": "ChC",
+    "Reds": "Cin",
+    "Brewers": "Mil",
+    "Pirates": "Pit",
+    "Cardinals": "StL",
+
+    "Rockies": "Col",
+    "Giants": "SF",
+    "D-backs": "Ari",
+    "Diamondbacks": "Ari",  # (as the projections have it)
+    "Dodgers": "LAD",
+    "Padres": "SD",
+
+    "Orioles": "Bal",
+    "Yankees": "NYY",
+    "Rays": "TB",
+    "Red Sox": "Bos",
+    "Blue Jays": "Tor",
+
+    "Twins": "Min",
+    "Indians": "Cle",
+    "Royals": "KC",
+    "White Sox": "CWS",
+    "Tigers": "Det",
+
+    "Athletics": "Oak",
+    "Rangers": "Tex",
+    "Astros": "Hou",
+    "Mariners": "Sea",
+    "Angels": "LAA"}
+
+# Lineup slots that hold players who can't play, so value doesn't matter there
+INACTIVE_POSITIONS = ("IL", "IL+", "NA")
+
+# The projection systems blended by value_players(how="projections"). Each has its CSVs (and the position type of the
+# players in each), the column its value is in, how much it counts, and (for CSVs that don't use the usual names) a
+# column mapping, e.g. "columns": {"Name": "PlayerName", "WAR": "fWAR"} (see projections.ProjectionStore)
+PROJECTION_SOURCES = {
+    "steamer": {"paths": ["data/proj_steamer_2020_b.csv", "data/proj_steamer_2020_p.csv"],
+                "position_types": ["B", "P"], "value_col": "WAR", "weight": 1.0},
+}
+
+
+def lineup_slots(positions: dict) -> pd.DataFrame:
+    """
+    Expands the league's position settings into one row per lineup slot
+
+    :param positions: the output of league.positions(), e.g. {'OF': {'count': 3, ...}, ...}
+    :return: a dataframe with a 'pos' column and one row per non-bench slot
+    """
+    lineup = pd.DataFrame(positions).T
+    lineup = lineup.loc[lineup.index.repeat(np.array(lineup['count'], dtype=int))]
+    lineup = lineup[lineup.index != "BN"]
+    lineup = lineup.reset_index()
+    lineup = lineup.rename(columns={"index": "pos"})
+    return lineup
+
+
+def eligibility_matrix(eligible_positions, positions) -> pd.DataFrame:
+    """
+    Which of some positions each player can play, as a boolean player x position matrix
+
+    :param eligible_positions: a series of each player's eligible positions (e.g., roster['eligible_positions'])
+    :param positions: the positions to check (e.g., league.positions())
+    :return: a boolean dataframe with the same index as eligible_positions and one column per position
+    """
+    eligible_positions = pd.Series(eligible_positions)
+    positions = pd.Index(list(positions))
+    exploded = eligible_positions.explode()
+    rows = np.repeat(np.arange(len(eligible_positions)), eligible_positions.map(lambda x: max(len(x), 1)).to_numpy())
+    cols = positions.get_indexer(exploded.to_numpy())
+    o = np.zeros((len(eligible_positions), len(positions)), dtype=bool)
+    o[rows[cols >= 0], cols[cols >= 0]] = True
+    return pd.DataFrame(o, index=eligible_positions.index, columns=positions)
+
+
+def playing_status(players: pd.DataFrame, probables: dict) -> np.ndarray:
+    """
+    Whether each of a bunch of players is playing on a day, all at once (see Roster.is_playing())
+
+    :param players: a dataframe indexed by player name, with status, team and eligible_positions columns
+    :param probables: the day's probables, from Roster.fetch_probables()
+    :return: an array with one quasi-boolean per player:
+         0 if not playing or day-to-day
+         1 if playing
+        -1 if on the IL or NA list
+    """
+    status = players['status'].to_numpy()
+    starter = eligibility_matrix(players['eligible_positions'], ["SP"])["SP"].to_numpy()
+
+    # Starting pitchers only play if they're probable starters, everyone else plays if their team does
+    o = (np.isin(players['team'].to_numpy(), probables['teams'])
+         & (~starter | np.isin(players.index.to_numpy(), probables['pitchers']))).astype(int)
+    o[status == "DTD"] = 0
+    o[np.isin(status, ["IL", "NA"])] = -1
+    return o
+
+
+def slot_weights(eligible: np.ndarray, inactive: np.ndarray, is_playing: np.ndarray, values: np.ndarray,
+                 bonus: float) -> np.ndarray:
+    """
+    The value of putting each of some players in each lineup slot, for Assignment
+
+    :param eligible: a boolean slot x player matrix of who could play where, if they're playing
+    :param inactive: whether each slot is an IL/NA slot
+    :param is_playing: whether each player is playing (see Roster.is_playing())
+    :param values: each player's value
+    :param bonus: what filling a slot is worth, which should be more than any amount of value
+        (so every slot that can be filled is filled, and value only decides who fills it)
+    :return: a slot x player matrix of weights, 0 where a player can't go
+    """
+    inactive = inactive[:, None]
+
+    # Players on the IL/NA lists can't play, so they're only eligible for the IL/NA slots
+    eligible = eligible & (inactive | (is_playing >= 0)[None, :])
+
+    # Same tiebreaker as before (players that aren't playing are worth nothing),
+    # except that value doesn't matter for who sits on the IL/NA lists
+    score = np.where(inactive, 0.0, (is_playing * values)[None, :])
+    return np.where(eligible, score + bonus, 0.0)
+
+
+# The stats each way of valuing players by their Yahoo stats uses, for batters and for pitchers
+STAT_COLUMNS = {"lastmonth": ("OPS", "ERA"), "season": ("wRAA", "FIP")}
+
+
+def stat_values(stats: pd.DataFrame, how: str) -> pd.Series:
+    """
+    Values players by their Yahoo stats (see Roster.value_players()): batters by their batting
+    stat, and pitchers by 1/their pitching stat (100 if it's 0)
+
+    :param stats: the output of league.player_stats(), as a dataframe
+    :param how: 'lastmonth' or 'season'
+    :return: a series of player values, indexed by player_id
+    """
+    batting, pitching = (stats[col].to_numpy(dtype=float) for col in STAT_COLUMNS[how])
+    with np.errstate(divide="ignore"):
+        values = np.where(~np.isnan(batting), batting, np.where(pitching == 0, 100, 1 / pitching))
+    return pd.Series(values, index=stats['player_id'].astype(int).to_numpy(), dtype=float)
+
+
+def mad(x) -> float:
+    """
+    Median absolute deviation
+    (like a standard deviation except for non-parametric data)
+    """
+    x = np.array(x)
+    return np.median(abs(x - np.median(x)))
+
+
+def norm_params(x: pd.Series) -> tuple:
+    """
+    The median and spread that norm_values() measures distances from the median in
+
+    :param x: values, NaN where there isn't one
+    :return: a tuple of (median, spread)
+    """
+    known = x.dropna().to_numpy()
+    if len(known) == 0:
+        return np.nan, 1.0
+    # If more than half of the players have the same value, the MAD is 0,
+    # so fall back on the mean absolute deviation
+    return np.median(known), mad(known) or np.mean(abs(known - np.median(known))) or 1.0
+
+
+def magic_weights(week: int, total_weeks: int = 9, start: float = 0.25, end: float = 1.0,
+                  season_share: float = 0.5) -> dict:
+    """
+    How much each source counts towards the "magic" valuation in a given week (see Roster.value_players())
+
+    The stats' share grows in a straight line from 'start' before the first week to 'end' in the last,
+    and the projections get whatever's left. The defaults are what's always been used.
+
+    :param week: the current week of the season
+    :param total_weeks: how many weeks in the season (9 is only valid for the shortened 2020 season)
+    :param start: the stats' share at the start of the season
+    :param end: the stats' share at the end of the season
+    :param season_share: how much of the stats' share goes to season stats (the rest goes to last month's)
+    :return: a dict of source -> weight
+    """
+    stats = start + (end - start) * week/total_weeks
+    weight_season = stats * season_share
+    weight_month = stats * (1 - season_share)
+    return {"season": weight_season, "lastmonth": weight_month, "steamer": 1 - weight_season - weight_month}
+
+
+def blend_values(raw: pd.DataFrame, norms: dict, weights: dict, center: float = 3) -> pd.Series:
+    """
+    Blends several valuations into one, after normalizing each non-parametrically
+    (distance from the median in MAD units)
+
+    'center' helps prevent really bad players from being started
+    e.g., center=3 means a player that is three MAD units below the median
+    (99th percentile bad) will never be a starter, since his value is negative
+
+    :param raw: a dataframe with one column of values per source (NaN where a source has nothing
+        on a player, who then gets 'center' for it)
+    :param norms: a dict of source -> (median, spread), from norm_params()
+    :param weights: a dict of source -> weight, e.g. from magic_weights()
+    :return: a series of blended values, with the same index as raw
+    """
+    o = pd.Series(0.0, index=raw.index)
+    for source, weight in weights.items():
+        median, spread = norms[source]
+        o += ((raw[source] - median)/spread + center).fillna(center) * weight
+    return o
+
+
+class Assignment:
+    """
+    Maximum-weight bipartite matching (Hungarian algorithm, O(n^2 m)) between the rows and columns of
+    a weight matrix, which can be repaired when some columns' weights change rather than solved again
+    from scratch (see update())
+
+    Besides the matching, this keeps the Hungarian algorithm's row and column potentials. When a
+    column changes, only that column's potential has to be fixed and its row matched again, which is
+    one augmenting path (O(m^2)) instead of the whole O(n^2 m) solve.
+    """
+
+    def __init__(self, weights: np.ndarray):
+        """
+        :param weights: an n x m matrix with at least as many columns as rows
+        """
+        weights = np.asarray(weights, dtype=float)
+        self.n, self.m = weights.shape
+        if self.n > self.m:
+            raise ValueError("More rows ({}) than columns ({})".format(self.n, self.m))
+
+        # Minimize cost == maximize weight. The rows past n are placeholders that can be paired with any
+        # column for nothing, and soak up the columns nobody's paired with. Since every column ends up
+        # paired, any one of them can be unpaired and paired again without upsetting the rest
+        self.offset = weights.max(initial=0)
+        self.cost = np.zeros((self.m, self.m))
+        self.cost[:self.n] = self.offset - weights
+        self.u = np.zeros(self.m + 1)  # Row potentials
+        self.v = np.zeros(self.m + 1)  # Column potentials
+        self.p = np.zeros(self.m + 1, dtype=int)  # p[j] is the (1-based) row matched to column j, 0 if none
+
+        for i in range(1, self.n + 1):
+            self.augment(i)
+        # The columns left over have potentials of 0, so pairing them with the placeholders is already optimal
+        free = np.flatnonzero(self.p[1:] == 0) + 1
+        self.p[free] = np.arange(self.n + 1, self.m + 1)
+
+    def augment(self, i: int) -> None:
+        """
+        Pairs an unpaired (1-based) row along the cheapest augmenting path
+        """
+        cost, u, v, p = self.cost, self.u, self.v, self.p
+        way = np.zeros(self.m + 1, dtype=int)
+        p[0] = i
+        j0 = 0
+        minv = np.full(self.m + 1, np.inf)
+        used = np.zeros(self.m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv, np.inf)
+            candidates[0] = np.inf
+            j1 = int(np.argmin(candidates))
+            delta = candidates[j1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Walk back along the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    def update(self, cols, weights: np.ndarray) -> None:
+        """
+        Changes the weights of some columns, and repairs the matching to suit
+
+        :param cols: the (0-based) columns that changed
+        :param weights: their new weights, an n x len(cols) matrix
+        """
+        cols = np.asarray(cols, dtype=int)
+        self.cost[:self.n, cols] = self.offset - np.asarray(weights, dtype=float).reshape(self.n, len(cols))
+
+        freed = []
+        for j in cols + 1:
+            # Unpair the column, and lower its potential until no row can do better with it
+            freed.append(self.p[j])
+            self.p[j] = 0
+            self.v[j] = np.min(self.cost[:, j - 1] - self.u[1:])
+
+        for i, j in zip(freed, cols + 1):
+            # If no row can do better with the column than the one that had it, it can just have it back
+            if self.p[j] == 0 and self.cost[i - 1, j - 1] - self.u[i] - self.v[j] <= 0:
+                self.p[j] = i
+            else:
+                self.augment(i)
+
+    def matching(self) -> np.ndarray:
+        """
+        :return: for each row, the index of the column it's paired with
+        """
+        o = np.full(self.n, -1)
+        paired = np.flatnonzero((self.p[1:] >= 1) & (self.p[1:] <= self.n))
+        o[self.p[paired + 1] - 1] = paired
+        return o
+
+
+def steamer_store() -> ProjectionStore:
+    """
+    The Steamer WAR projections (see Roster.value_players()), compiled into data/compiled/steamer
+    """
+    # (projections imports pandas and numpy for real, so it's only imported when needed)
+    from projections import ProjectionStore
+    return ProjectionStore(["data/proj_steamer_2020_b.csv",  # Batter projections
+                            "data/proj_steamer_2020_p.csv"],  # Pitcher projections
+                           compiled_dir="data/compiled/steamer",
+                           normalize=Roster.cleanup_name,
+                           position_types=["B", "P"],
+                           team_abbrevs=TEAM_ABBREVS)
+
+
+def projection_blend(sources: dict = None) -> ProjectionBlend:
+    """
+    A blend of several projection systems (see Roster.value_players()), each compiled into data/compiled/blend
+
+    :param sources: the projection systems to blend, if not PROJECTION_SOURCES
+    """
+    from projections import ProjectionBlend, ProjectionStore
+    sources = PROJECTION_SOURCES if sources is None else sources
+    stores = {name: ProjectionStore(source["paths"],
+                                    compiled_dir=os.path.join("data/compiled/blend", name),
+                                    normalize=Roster.cleanup_name,
+                                    value_col=source.get("value_col", "WAR"),
+                                    unknown=np.nan,
+                                    position_types=source.get("position_types"),
+                                    team_abbrevs=TEAM_ABBREVS,
+                                    columns=source.get("columns"),
+                                    standardized=True)
+              for name, source in sources.items()}
+    weights = {name: source.get("weight", 1.0) for name, source in sources.items()}
+    return ProjectionBlend(stores, weights)
+
+
+def shared_setup(workers: int, oauth_path: str = "oauth.json", cache_dir: str = None, rate: float = 5.0,
+                 schedule_path: str = None) -> dict:
+    """
+    Everything the teams in a run (see run_leagues() and run_daemon()) share: one OAuth session, one
+    response cache, one rate limit, one schedule index, one player details cache and one of each
+    projection store
+
+    :param workers: the most teams that'll be worked on at once
+    :param oauth_path: where the OAuth token is saved
+    :param cache_dir: where to keep API responses between runs (optional)
+    :param rate: how many Yahoo calls a second to make, across all of the teams (see RequestScheduler)
+    :param schedule_path: where to keep the season's schedule between runs (optional, see schedule_index())
+    :return: a dict of Roster arguments, with the keys oauth, cache, scheduler, schedule, player_details,
+        steamer and projections
+    """
+    oauth = update_oauth(oauth_path)
+
+    # Finish the lazy imports before there are threads to race over them
+    for module in (mlbgame, yfa, pd, np, unidecode):
+        getattr(module, "__name__", None)
+
+    cache = ResponseCache(disk_dir=cache_dir)
+    return {"oauth": oauth,
+            "cache": cache,
+            "scheduler": RequestScheduler(rate=rate, concurrency=2 * workers),
+            "schedule": schedule_index(schedule_path, cache),
+            "player_details": PlayerDetailsCache(),
+            "steamer": steamer_store(),
+            "projections": projection_blend()}
+
+
+def resolve_league_key(league: str, oauth: yahoo_oauth.OAuth2, cache: ResponseCache = None) -> str:
+    """
+    :param league: a league name or league key (e.g., "398.l.12345")
+    :return: the league key
+    """
+    league_key = league if re.fullmatch(r"\d+\.l\.\d+", league) else find_league_key(oauth, 'mlb', league, cache)
+    if not league_key:
+        raise ValueError("Can't find league '{}'".format(league))
+    return league_key
+
+
+def run_leagues(leagues: list, values: str = "magic", workers: int = 4,
+                oauth_path: str = "oauth.json", dry_run: bool = False, cache_dir: str = None,
+                check: bool = False, days: int = 1, rate: float = 5.0, schedule_path: str = None) -> list:
+    """
+    Optimizes and sets the lineups of several teams at once
+
+    All of the teams share one OAuth session and one set of MLB GameDay calls, and are
+    run in a pool of worker threads, so this takes about as long as the slowest team.
+
+    :param leagues: league names or league keys (e.g., "398.l.12345")
+    :param values: how to value players (see Roster.value_players())
+    :param workers: the most teams to work on at once
+    :param oauth_path: where the OAuth token is saved
+    :param dry_run: work out the lineups without changing anything
+    :param cache_dir: where to keep API responses between runs (optional)
+    :param check: only find out whether there's anything to change (see Roster.pending_moves())
+    :param days: how many days of lineups to set, starting with the next one (see Roster.plan_week())
+    :param rate: how many Yahoo calls a second to make, across all of the teams (see RequestScheduler)
+    :param schedule_path: where to keep the season's schedule between runs (optional, see schedule_index())
+    :return: a list with one dict per league with the keys league, league_key, ok,
+        error, moves, seconds and metrics (see Roster.metrics)
+    """
+
+    logger = logging.getLogger('yahoo-fantasy')
+    shared = shared_setup(workers, oauth_path, cache_dir, rate, schedule_path)
+    schedule = shared["schedule"]
+
+    # Bring today's games (and tomorrow's, if that's the day that'll be set) up to date once, up front
+    today = datetime.today()
+    if schedule.first_pitch(today) <= datetime.now().hour + 1:
+        schedule.probables(today + timedelta(days=1))
+
+    def run_one(league: str) -> dict:
+        start = time.perf_counter()
+        o = {"league": league, "league_key": None, "ok": False, "error": None, "moves": None, "metrics": None}
+        ros = None
+        try:
+            o["league_key"] = resolve_league_key(league, shared["oauth"], shared["cache"])
+            ros = Roster(o["league_key"], values=values, lazy=check, **shared)
+            if check:
+                payloads = ros.pending_moves()
+            elif days > 1:
+                week = ros.set_week(ros.plan_week(days), dry_run=dry_run)
+                payloads = [[move for day in week.values() if day for move in day[0]]]
+            else:
+                payloads = ros.set_lineup(ros.optimize_lineup(), dry_run=dry_run)
+            o["moves"] = len(payloads[0]) if payloads else 0
+            o["ok"] = True
+        except Exception as e:
+            logger.warning("Failed: {} ({})".format(league, e))
+            o["error"] = repr(e)
+        o["seconds"] = time.perf_counter() - start
+        if ros is not None:
+            o["metrics"] = ros.metrics.summary()
+        return o
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_one, leagues))
+
+    for result in results:
+        logger.info("{league}: {status} in {seconds:.1f}s".format(
+            status="OK" if result["ok"] else "FAILED ({})".format(result["error"]), **result))
+    return results
+
+
+def run_daemon(leagues: list, values: str = "magic", workers: int = 4, oauth_path: str = "oauth.json",
+               dry_run: bool = False, cache_dir: str = None, poll: timedelta = timedelta(minutes=30),
+               passes: int = None, rate: float = 5.0, schedule_path: str = None) -> None:
+    """
+    Keeps the lineups of several teams set, waking up on a schedule built around the day's games (see next_wakeup())
+
+    Unlike run_leagues(), everything is kept between passes: the OAuth session, the league, team and
+    position settings, the response caches and player valuations. Each pass only fetches the rosters
+    and probables again, and a lineup is only optimized and set when one of them has actually
+    changed since the last pass (see Roster.snapshot()).
+
+    :param leagues: league names or league keys (e.g., "398.l.12345")
+    :param values: how to value players (see Roster.value_players())
+    :param workers: the most teams to work on at once
+    :param oauth_path: where the OAuth token is saved
+    :param dry_run: work out the lineups without changing anything
+    :param cache_dir: where to keep API responses between runs (optional)
+    :param poll: how often to look while today's lineup can still change
+    :param passes: stop after this many passes (default: run until interrupted)
+    :param rate: how many Yahoo calls a second to make, across all of the teams (see RequestScheduler)
+    :param schedule_path: where to keep the season's schedule between runs (optional, see schedule_index())
+    """
+
+    logger = logging.getLogger('yahoo-fantasy')
+    shared = shared_setup(workers, oauth_path, cache_dir, rate, schedule_path)
+    schedule = shared["schedule"]
+    rosters = []
+    for league in leagues:
+        league_key = resolve_league_key(league, shared["oauth"], shared["cache"])
+        rosters.append(Roster(league_key, values=values, lazy=True, **shared))
+    last_seen = {ros.league_key: None for ros in rosters}
+
+    def run_one(ros: Roster) -> None:
+        try:
+            ros.refresh()
+            seen = ros.snapshot()
+            if seen == last_seen[ros.league_key]:
+                logger.info("{}: nothing has changed".format(ros.league_key))
+                return
+            target = ros.reoptimize()
+            ros.set_lineup(target, dry_run=dry_run)
+            # Once the lineup's set, the next pass will find the players where they were just put
+            last_seen[ros.league_key] = seen if dry_run else ros.snapshot(target['target_position'])
+        except Exception as e:
+            logger.warning("Failed: {} ({})".format(ros.league_key, e))
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while passes is None or done < passes:
+            rosters[0].refresh_token()  # (The session is shared, so this refreshes it for everyone)
+            list(pool.map(run_one, rosters))
+            done += 1
+            if passes is not None and done >= passes:
+                break
+
+            wake = next_wakeup(datetime.now(), schedule.first_pitch(datetime.today()), poll)
+            logger.info("Sleeping until {}".format(wake.strftime("%Y-%m-%d %H:%M")))
+            time.sleep(max(0.0, (wake - datetime.now()).total_seconds()))
 
 
 class Roster:
 
-    def __init__(self, league_key, values="steamer", oauth_path="oauth.json"):
+    def __init__(self, league_key, values="steamer", oauth_path="oauth.json",
+                 details_path="player_details.json", oauth: yahoo_oauth.OAuth2 = None, cache: ResponseCache = None,
+                 metrics=True, lazy: bool = False, magic: dict = None, scheduler: RequestScheduler = None,
+                 schedule: ScheduleIndex = None, projection_sources: dict = None,
+                 player_details: PlayerDetailsCache = None, steamer: ProjectionStore = None,
+                 projections: ProjectionBlend = None):
+        """
+        :param league_key: the key of the league the team is in, e.g. from find_league_key()
+        :param values: how to value players (see value_players())
+        :param oauth_path: where the OAuth token is saved
+        :param details_path: where player details are cached
+        :param oauth: an existing OAuth session to share, instead of making one from oauth_path
+        :param cache: a ResponseCache to share, so GameDay and league settings are only fetched once
+        :param metrics: whether to time each stage and count remote calls (or a Metrics to collect them in)
+        :param lazy: don't fetch anything until it's needed (e.g., roster, league, team are fetched on first use)
+        :param magic: settings for the "magic" valuation's weights, e.g. {"total_weeks": 26} (see magic_weights())
+        :param scheduler: a RequestScheduler to share, so several teams together stay under Yahoo's rate limit
+        :param schedule: a ScheduleIndex to share, so the schedule and probables are only fetched once
+        :param projection_sources: the projection systems to blend, if not PROJECTION_SOURCES
+        :param player_details: a PlayerDetailsCache to share, instead of loading one from details_path
+        :param steamer: the Steamer ProjectionStore to share (see steamer_store())
+        :param projections: the ProjectionBlend to share, instead of blending projection_sources
+            (see projection_blend())
+        """
         # Setup the logger
         self.logger = logging.getLogger('yahoo-fantasy')
         formatter = logging.Formatter('%(asctime)7s - %(name)s - %(levelname)s - %(message)s')
@@ -105,51 +743,231 @@ class Roster:
         self.logger.setLevel(logging.DEBUG)
 
         # Rotate the log files at midnight, keep a week's worth of logging
-        fh = logging.handlers.TimedRotatingFileHandler(filename='lineup.log', when='D', interval=2, backupCount=1)
-        fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
+        # (only once, since every Roster shares the same logger)
+        if not self.logger.handlers:
+            fh = logging.handlers.TimedRotatingFileHandler(filename='lineup.log', when='D', interval=2, backupCount=1)
+            fh.setFormatter(formatter)
+            self.logger.addHandler(fh)
 
+        # How long each stage takes, and how many remote calls it makes
+        self.metrics = Metrics(enabled=metrics, league_key=league_key) if isinstance(metrics, bool) else metrics
+
+        self.league_key = league_key
+        self.values = values
+        self.magic = dict() if magic is None else magic
+        self.projection_sources = PROJECTION_SOURCES if projection_sources is None else projection_sources
+        self.oauth_path = oauth_path
+        if oauth is not None:
+            self.oauth = oauth
+        if steamer is not None:
+            self.steamer = steamer
+        if projections is not None:
+            self.projections = projections
+        self.cache = ResponseCache() if cache is None else cache
+        self.scheduler = RequestScheduler() if scheduler is None else scheduler
+        self.schedule = schedule_index(cache=self.cache) if schedule is None else schedule
+        self.player_details = PlayerDetailsCache(details_path) if player_details is None else player_details
+        self.valuations = dict()
+        self.lineup_state = None  # (see optimize_lineup())
+        self.blend = None  # (see value_players())
+
+        # Everything else is worked out the first time it's needed (see the properties below).
+        # Unless this is lazy, work it all out now, in order
+        if not lazy:
+            for attribute in ("oauth", "league", "positions", "team", "when", "probables", "players", "roster"):
+                getattr(self, attribute)
+
+    @lazy_property
+    def oauth(self) -> yahoo_oauth.OAuth2:
         # Create and confirm that OAuth2 token is updated
-        self.oauth = update_oauth(oauth_path)
-        assert self.oauth.token_is_valid()
+        with self.metrics.stage("oauth"):
+            oauth = update_oauth(self.oauth_path)
+            assert oauth.token_is_valid()
+            watch(getattr(oauth, "session", None))
+            return oauth
 
+    @lazy_property
+    def league(self) -> yfa.league.League:
         # Create the Yahoo Fantasy abstraction
-        self.league_key = league_key
-        self.logger.info("Getting league info...")
-        self.league = yfa.league.League(self.oauth, league_key)
-        self.positions = self.league.positions()
-        self.logger.info("Getting team info...")
-        self.team = yfa.team.Team(self.oauth, self.league.team_key())
-
-        # Stop optimizing today's roster an hour before the first game starts
-        if earliest_game() > datetime.now().hour + 1:
-            self.when = datetime.today()
-        else:
-            self.when = datetime.today() + timedelta(days=1)
-        self.logger.info("Updating lineup for {}".format(self.when.date()))
+        oauth = self.oauth
+        with self.metrics.stage("league"):
+            self.logger.info("Getting league info...")
+            watch(getattr(oauth, "session", None))
+            return yfa.league.League(oauth, self.league_key)
+
+    @lazy_property
+    def positions(self) -> dict:
+        league = self.league
+        with self.metrics.stage("league"):
+            return self.cache.get("positions", self.league_key,
+                                  lambda: self.scheduler.call("league/settings", league.positions))
+
+    @lazy_property
+    def team(self) -> yfa.team.Team:
+        league = self.league
+        with self.metrics.stage("league"):
+            self.logger.info("Getting team info...")
+            return yfa.team.Team(self.oauth, self.scheduler.call("users/games/teams", league.team_key))
+
+    @lazy_property
+    def when(self) -> datetime:
+        with self.metrics.stage("gameday"):
+            # Stop optimizing today's roster an hour before the first game starts
+            if self.schedule.first_pitch(datetime.today()) > datetime.now().hour + 1:
+                when = datetime.today()
+            else:
+                when = datetime.today() + timedelta(days=1)
+            self.logger.info("Updating lineup for {}".format(when.date()))
+            return when
 
+    @lazy_property
+    def probables(self) -> dict:
         # Fetches the probable starters and teams from MLB GameDay API
-        self.probables = self.fetch_probables()
+        self.when  # (Decided outside of this stage)
+        with self.metrics.stage("gameday"):
+            return self.fetch_probables()
+
+    @lazy_property
+    def players(self) -> pd.DataFrame:
+        # A "roster" is all of the players that are on a team. This is the roster as Yahoo has it,
+        # before it's valued and indexed by name
+        team, when = self.team, self.when
+        with self.metrics.stage("roster"):
+            self.logger.info("Fetching current roster...")
+            players = pd.DataFrame(self.scheduler.call("team/roster", team.roster, day=when))
+
+            # Clean up the player names
+            players['name'] = players['name'].map(self.cleanup_name)
+
+        # Ask Yahoo which team each player plays for, in one request for the players we haven't seen lately.
+        # (Needed before valuing players, to tell apart players with the same name)
+        with self.metrics.stage("player_details"):
+            details, counts = self.player_details.get(self.league, players['player_id'], self.scheduler)
+            players['team'] = [details[x]["editorial_team_abbr"] for x in players['player_id']]
+            # (Just this team's players, since the cache may be shared with other teams)
+            self.logger.info("{}: player details {hits} cached, {misses} fetched".format(self.league_key, **counts))
+        return players
+
+    @lazy_property
+    def steamer(self) -> ProjectionStore:
+        # WAR projections for each player that are used to break ties
+        return steamer_store()
+
+    @lazy_property
+    def projections(self) -> ProjectionBlend:
+        # Every projection system in self.projection_sources, each compiled (and standardized) on its own
+        return projection_blend(self.projection_sources)
+
+    @lazy_property
+    def roster(self) -> pd.DataFrame:
+        # The roster, indexed by player name, with each player's value, team and whether they're playing
+        players = self.players
+        self.probables  # (Fetched outside of these stages)
+
+        # Assign an approximate value to each player
+        with self.metrics.stage("value_players"):
+            roster = players.copy()
+            values = self.value_players(how=self.values)
+            # (Joined on player_id, so values can't end up next to the wrong player)
+            roster['value'] = values.reindex(roster['player_id']).to_numpy() if values is not None else None
+
+        roster = roster.set_index('name')
+
+        with self.metrics.stage("is_playing"):
+            self.logger.info("Determining likely starters for {}...".format(self.when.date()))
+            # Determine whether each player on the roster is playing
+            roster['is_playing'] = playing_status(roster, self.probables)
+        return roster
+
+    @lazy_property
+    def eligibility(self) -> pd.DataFrame:
+        # Which of the league's positions each player on the roster can play (player x position, boolean)
+        return eligibility_matrix(self.roster['eligible_positions'], self.positions)
+
+    def pending_moves(self) -> list:
+        """
+        Whether there's anything to change in the lineup, doing as little work as possible to find out.
+        If no teams are playing, nothing is fetched beyond the schedule.
 
-        # A "roster" is all of the players that are on a team
-        self.logger.info("Fetching current roster...")
-        self.roster = pd.DataFrame(self.team.roster(day=self.when))
+        :return: the payloads set_lineup() would send (empty if there's nothing to change)
+        """
+        if not self.probables['teams']:
+            self.logger.info("No games on {}, nothing to change".format(self.when.date()))
+            return []
+        return self.plan_moves(self.optimize_lineup())
 
-        # Clean up the player names
-        self.roster['name'] = self.roster['name'].map(self.cleanup_name)
+    def refresh(self) -> None:
+        """
+        Forgets everything that changes through the day (the date being set, probables and roster),
+        so that it's fetched again the next time it's needed. The OAuth session, league, team and
+        position settings are kept, and so are player valuations until the date moves on.
+        """
+        before = self.__dict__.get("when")
+        for attribute in ("when", "probables", "players", "roster", "eligibility"):
+            self.__dict__.pop(attribute, None)
+        if before is not None and self.when.date() != before.date():
+            self.valuations = dict()
 
-        # Assign an approximate value to each player
-        self.roster['value'] = self.value_players(how=values)
+    def snapshot(self, positions: pd.Series = None) -> tuple:
+        """
+        Everything the lineup depends on that can change through the day: the date being set, the probables,
+        and each player's status, eligibility and position. If two snapshots are the same, so is the lineup.
+
+        :param positions: the positions of any players that aren't where they are now (e.g., a target lineup's)
+        :return: a hashable snapshot
+        """
+        roster = self.roster
+        positions = roster['selected_position'] if positions is None else \
+            positions.reindex(roster.index).fillna(roster['selected_position'])
+        players = sorted(zip(roster['player_id'], roster['status'], positions,
+                             (tuple(x) for x in roster['eligible_positions'])))
+        return (self.when.date(), tuple(players),
+                tuple(sorted(self.probables['pitchers'])), tuple(sorted(self.probables['teams'])))
+
+    def playing_matrix(self, days: list) -> np.ndarray:
+        """
+        Whether each player is playing on each of a number of days, using the same rules as is_playing()
+
+        :param days: the dates to check
+        :return: a player x day array (in the order of self.roster), 1 if playing, 0 if not
+            playing or day-to-day, -1 if on the IL or NA list
+        """
+        o = np.zeros((len(self.roster), len(days)), dtype=int)
+        for day, when in enumerate(days):
+            o[:, day] = playing_status(self.roster, self.fetch_probables(when))
+        return o
+
+    @staged("plan_week")
+    def plan_week(self, days: int = 7) -> dict:
+        """
+        Works out the lineup for several days at once, starting from self.when
+
+        The roster, valuations and schedule are only fetched once, so the only work done per day
+        is solving the lineup. Each day starts from the previous day's lineup, since that's what
+        Yahoo carries forward.
 
-        self.roster = self.roster.set_index('name')
+        :param days: how many days to plan
+        :return: a dict of date -> target lineup (see optimize_lineup())
+        """
+        dates = [self.when + timedelta(days=day) for day in range(days)]
+        playing = self.playing_matrix(dates)
 
-        # Ask Yahoo which team each player plays for
-        self.roster['team'] = [self.league.player_details(x)[0]["editorial_team_abbr"]
-                               for x in self.roster['player_id']]
+        o = dict()
+        current = self.roster['selected_position']
+        for day, when in enumerate(dates):
+            o[when] = self.optimize_lineup(is_playing=playing[:, day], current=current)
+            current = o[when]['target_position']
+        return o
+
+    def set_week(self, plans: dict, dry_run: bool = False) -> dict:
+        """
+        Sets the lineups from plan_week()
 
-        self.logger.info("Determining likely starters for {}...".format(self.when.date()))
-        # Determine whether each player on the roster is playing
-        self.roster['is_playing'] = [self.is_playing(player) for player in self.roster.index]
+        :param plans: a dict of date -> target lineup
+        :param dry_run: if True, don't change anything, just return the payloads that would be sent
+        :return: a dict of date -> the payloads that were (or would be) sent to Yahoo
+        """
+        return {when: self.set_lineup(target, dry_run=dry_run, when=when) for when, target in plans.items()}
 
     @staticmethod
     def cleanup_name(x: str) -> str:
@@ -158,76 +976,24 @@ class Roster:
         Removes accents/hyphens/periods from a player's name for easier joins
         """
 
-        o = unidecode(x)
+        o = unidecode.unidecode(x)
         o = o.replace('-', ' ')
         o = o.replace('.', '')
         return o
 
-    def fetch_probables(self) -> dict:
+    def fetch_probables(self, when: datetime = None) -> dict:
 
         """
         Gets a list of probable starters for a given date
-        from MLB GameDay API
+        from the season's schedule (see schedule_index()), which only asks
+        MLB GameDay again about the next day or so
 
+        :param when: the date, if not self.when
         :return: a dict with keys "pitchers" containing probable pitchers
             and "teams" containing teams that are playing
         """
 
-        # Translate between the names GameDay uses (keys) and the names YF uses (values)
-        abbrevs = {
-            "Braves": "Atl",
-            "Marlins": "Mia",
-            "Mets": "NYM",
-            "Phillies": "Phi",
-            "Nationals": "Was",
-
-            "Cubs": "ChC",
-            "Reds": "Cin",
-            "Brewers": "Mil",
-            "Pirates": "Pit",
-            "Cardinals": "StL",
-
-            "Rockies": "Col",
-            "Giants": "SF",
-            "D-backs": "Ari",
-            "Dodgers": "LAD",
-            "Padres": "SD",
-
-            "Orioles": "Bal",
-            "Yankees": "NYY",
-            "Rays": "TB",
-            "Red Sox": "Bos",
-            "Blue Jays": "Tor",
-
-            "Twins": "Min",
-            "Indians": "Cle",
-            "Royals": "KC",
-            "White Sox": "CWS",
-            "Tigers": "Det",
-
-            "Athletics": "Oak",
-            "Rangers": "Tex",
-            "Astros": "Hou",
-            "Mariners": "Sea",
-            "Angels": "LAA"}
-
-        pitchers = []
-        teams = []
-        for game in mlbgame.day(self.when.year, self.when.month, self.when.day):
-            if game.game_status == 'PRE_GAME':
-                if len(game.p_pitcher_home) > 2:
-                    pitchers.append(game.p_pitcher_home)
-                if len(game.p_pitcher_away) > 2:
-                    pitchers.append(game.p_pitcher_away)
-                if game.home_team not in teams:
-                    teams.append(abbrevs[game.home_team])
-                if game.away_team not in teams:
-                    teams.append(abbrevs[game.away_team])
-        pitchers = [self.cleanup_name(name) for name in pitchers]
-        o = dict()
-        o["pitchers"] = pitchers
-        o["teams"] = teams
-        return o
+        return self.schedule.probables(self.when if when is None else when)
 
     def refresh_token(self) -> None:
         """
@@ -237,96 +1003,199 @@ class Roster:
         """
         if self.oauth.token_is_valid():
             return
-        else:
-            self.oauth.refresh_access_token()
-            # https://github.com/josuebrunel/yahoo-oauth/issues/55#issuecomment-602217706
-            self.oauth.session = self.oauth.oauth.get_session(token=self.oauth.access_token)
-            # Apparently this is a bug
-            return
+        # (Through the TokenManager, which only refreshes it if no one else has, and keeps the session)
+        self.oauth.refresh_access_token()
+        watch(self.oauth.session)
 
-    def is_playing(self, player: str) -> int:
+    def is_playing(self, player: str, roster: pd.DataFrame = None) -> int:
         """
         Determines whether a player is playing, based on the probables
         :param player: the name of a player
+        :param roster: the roster to look the player up in, if not self.roster
         :return: a quasi-boolean:
              0 if not playing or day-to-day
              1 if playing
             -1 if on the IL or NA list
         """
 
-        _, status, _, elig, _, _, _team, *_ = self.roster.loc[player, ]
-        if status in ("IL", "NA"):
-            return -1
-        if status == "DTD":
-            return 0
-        if _team not in self.probables['teams']:
-            return 0
-        if 'SP' in elig and player not in self.probables['pitchers']:
-            return 0
-        else:
-            return 1
-
-    def optimize_lineup(self):
-
-        lineup = pd.DataFrame(self.league.positions()).T
-        lineup = lineup.loc[lineup.index.repeat(np.array(lineup['count']))]
-        lineup = lineup[lineup.index != "BN"]
-        lineup = lineup.reset_index()
-        lineup = lineup.rename(columns={"index": "pos"})
-        lineup['final_player'] = [None for _ in range(0, len(lineup))]
-        assigned_players = []
-
-        while None in lineup['final_player'].unique():
-            for _ in (_ for _ in lineup.final_player if _ is None):
-                lineup['eligible_players'] = [[] for _ in range(0, len(lineup))]
-                # Assign each position a list of eligible players
-                for row in lineup.itertuples():
-                    index, pos, _, _, final_player, eligible_players = row
-                    # If there's already a player assigned to the position, continue
-                    if final_player:
-                        continue
-                    for player in self.roster.itertuples():
-                        name, _, _, _, eligible_positions, *_ = player
-                        # If the player is already assigned, next
-                        if name in assigned_players:
-                            continue
-                        if pos in eligible_positions:
-                            eligible_players.append(name)
-                    # If there's only one eligible player, cut to the chase and assign him
-                    if len(eligible_players) == 1:
-                        lineup.loc[index, 'final_player'] = eligible_players[0]
-                        self.logger.info("Assigning {player} to {pos}".format(
-                            player=eligible_players[0],
-                            pos=lineup.loc[index, 'pos']))
-                        assigned_players = [player for player in lineup.final_player if player is not None]
-
-            # Perform tiebreakers based on expected value
-            tb_row = np.where([x is None for x in lineup.final_player])[0][0]  # Which row to tiebreak
-            # If there are no eligible players, put the final player in the slot as "Empty"
-            if len(lineup.eligible_players[tb_row]) == 0:
-                lineup.final_player[tb_row] = "Empty"
+        roster = self.roster if roster is None else roster
+        return int(playing_status(roster.loc[[player]], self.probables)[0])
+
+    @staged("optimize_lineup")
+    def optimize_lineup(self, is_playing: np.ndarray = None, current: pd.Series = None) -> pd.DataFrame:
+        """
+        Finds the lineup with the most total value by solving it as an assignment problem.
+
+        Every (slot, player) pair is scored once in a NumPy matrix, then the maximum-weight
+        matching between slots and players is found exactly, so multi-position players
+        end up wherever they're worth the most.
+
+        :param is_playing: whether each player is playing, if not self.roster['is_playing'] (e.g., for another day)
+        :param current: each player's position going in, if not self.roster['selected_position']
+        :return: a dataframe indexed by player name with the columns current_position,
+            player_id and target_position (and the league's position settings), for set_lineup()
+        """
+
+        lineup = lineup_slots(self.positions)
+        slots = lineup['pos'].to_numpy()
+        names = self.roster.index
+        is_playing = self.roster['is_playing'].to_numpy() if is_playing is None else np.asarray(is_playing)
+        current = self.roster['selected_position'] if current is None else current
+
+        # Everything about the problem that doesn't depend on who's playing is kept, so that the
+        # lineup can be repaired when a player's status changes (see update_lineup())
+        values = np.nan_to_num(self.roster['value'].to_numpy(dtype=float))
+        state = self.lineup_state = {
+            "when": self.when.date() if "when" in self.__dict__ else None,
+            "lineup": lineup,
+            "slots": slots,
+            "names": names,
+            "eligible_positions": tuple(tuple(x) for x in self.roster['eligible_positions']),
+            # Boolean slot x player matrix of who can play where, if they're playing
+            "eligible": self.eligibility[slots].to_numpy().T,
+            "inactive": np.isin(slots, INACTIVE_POSITIONS),
+            "values": values,
+            # Filling a slot is always worth more than any amount of value (whoever's playing),
+            # so every slot that can be filled is filled, and value only decides who fills it
+            "bonus": 2 * np.abs(values).sum() + 1,
+            "stay": slots[:, None] == np.asarray(current)[None, :],
+            "is_playing": np.array(is_playing, dtype=int),
+        }
+        state["weights"] = self.lineup_weights(np.arange(len(names)), state["is_playing"])
+
+        # The extra columns are "Empty" placeholders, one per slot, for slots that nobody can fill
+        state["assignment"] = Assignment(np.hstack([state["weights"], np.zeros((len(slots), len(slots)))]))
+
+        o = self.lineup_target(current)
+        self.logger.info("Finished optimizing lineup!")
+        return o
+
+    def lineup_weights(self, players: np.ndarray, is_playing: np.ndarray) -> np.ndarray:
+        """
+        The value of putting each of some players in each slot, for optimize_lineup()
+
+        :param players: the players' positions in the roster
+        :param is_playing: whether each of them is playing (see is_playing())
+        :return: a slot x player matrix of weights, 0 where a player can't go
+        """
+        state = self.lineup_state
+        weights = slot_weights(state["eligible"][:, players], state["inactive"], is_playing,
+                               state["values"][players], state["bonus"])
+
+        # Between equally good lineups, prefer the one that moves the fewest players
+        return weights + 1e-6 * ((weights > 0) & state["stay"][:, players])
+
+    def lineup_target(self, current: pd.Series, changed: np.ndarray = None) -> pd.DataFrame:
+        """
+        Reads the target lineup from the last optimize_lineup() (or update_lineup()) solution
+
+        :param current: each player's position going in
+        :param changed: only log the slots whose player changed since this solution (a matching), if given
+        :return: the target lineup (see optimize_lineup())
+        """
+        state = self.lineup_state
+        lineup, slots, names = state["lineup"].copy(), state["slots"], state["names"]
+
+        final_player = []
+        for row, col in enumerate(state["assignment"].matching()):
+            quiet = changed is not None and changed[row] == col
+            if col >= len(names) or state["weights"][row, col] <= 0:
+                if not quiet:
+                    self.logger.warning("No eligible player for {}".format(slots[row]))
+                final_player.append("Empty")
                 continue
-            tb = self.roster[self.roster.index.isin(lineup.eligible_players[tb_row])]  # Filter roster for those players
-            tb = tb.assign(value=tb.is_playing * tb.value)  # Approximate their value
-            try:
-                best = tb.index[tb.value == max(tb.value)][0]  # Player with highest value
-                self.logger.info("Optimizing {player} to {pos}".format(
-                    player=best,
-                    pos=lineup.pos[tb_row]))
-            except IndexError:
-                self.logger.warning("Failed assigning {}".format(lineup.pos[tb_row]))
-
-            lineup.final_player[tb_row] = best
-            assigned_players = [player for player in lineup['final_player'].unique() if player is not None]
-
-        o = self.roster[['selected_position', 'player_id']].join(lineup.set_index('final_player'))
+            if not quiet:
+                self.logger.info("Assigning {player} to {pos}".format(player=names[col], pos=slots[row]))
+            final_player.append(names[col])
+        lineup['final_player'] = final_player
+
+        o = pd.DataFrame({"selected_position": np.asarray(current),
+                          "player_id": self.roster['player_id'].to_numpy()}, index=names)
+        o = o.join(lineup.set_index('final_player'))
         o['pos'] = o['pos'].fillna("BN")
         o = o.rename(columns={"pos": "target_position",
                               "selected_position": "current_position"})
-        self.logger.info("Finished optimizing lineup!")
+        state["target"] = o
         return o
 
-    def set_lineup(self, target: pd.DataFrame) -> None:
+    @staged("optimize_lineup")
+    def update_lineup(self, changes: dict) -> pd.DataFrame:
+        """
+        Repairs the last lineup from optimize_lineup() after some players' statuses change (e.g., a late scratch),
+        rather than optimizing the whole lineup again. Only the slots those players were in, or could move
+        into, are worked out again, so this stays quick no matter how many times it's called.
+
+        :param changes: a dict of player name -> whether they're playing now (see is_playing())
+        :return: the players whose position changes, with the same columns as optimize_lineup()
+            (current_position being where the last lineup put them), for set_lineup()
+        """
+        state = self.lineup_state
+        before = state["target"]
+        players = np.array([state["names"].get_loc(name) for name in changes], dtype=int)
+        state["is_playing"][players] = list(changes.values())
+        self.roster.loc[list(changes), 'is_playing'] = list(changes.values())
+
+        weights = self.lineup_weights(players, state["is_playing"][players])
+        state["weights"][:, players] = weights
+        matching = state["assignment"].matching()
+        state["assignment"].update(players, weights)
+
+        after = self.lineup_target(before['target_position'], changed=matching)
+        return after[after['current_position'] != after['target_position']]
+
+    def reoptimize(self) -> pd.DataFrame:
+        """
+        optimize_lineup(), but using update_lineup() when the only thing that's changed since the last lineup
+        was set is who's playing (which is most of what changes through a day)
+
+        :return: a target lineup for set_lineup()
+        """
+        state = self.lineup_state
+        if state is None or "target" not in state or state["when"] != self.when.date() \
+                or not state["names"].equals(self.roster.index) \
+                or state["eligible_positions"] != tuple(tuple(x) for x in self.roster['eligible_positions']) \
+                or not (state["target"]['target_position'] == self.roster['selected_position']).all():
+            return self.optimize_lineup()
+
+        is_playing = self.roster['is_playing'].to_numpy()
+        changed = np.flatnonzero(is_playing != state["is_playing"])
+        return self.update_lineup(dict(zip(self.roster.index[changed], is_playing[changed])))
+
+    @staticmethod
+    def plan_moves(target: pd.DataFrame, staged: bool = False) -> list:
+        """
+        Works out the position changes needed to get from the current lineup to a target lineup,
+        as a list of change_positions() payloads. Only players whose position changes are moved.
+
+        Yahoo checks the lineup after each payload, not after each player in it, so normally
+        everything goes in one payload. If staged, the changes are split into two payloads that
+        are each valid on their own: first everyone who's moving goes to the bench (except IL <-> NA
+        swaps, which go straight there or YFA gets mad about too many players on a given list),
+        then everyone on the bench goes to their target position.
+
+        :param target: a dataframe describing a target lineup, probably generated by optimize_lineup()
+        :param staged: whether to split the changes into two payloads
+        :return: a list of payloads, each a list of {"player_id", "selected_position"} dicts
+        """
+
+        moves = target[target['current_position'] != target['target_position']]
+        if len(moves) == 0:
+            return []
+        if not staged:
+            return [[{"player_id": int(row.player_id), "selected_position": row.target_position}
+                     for row in moves.itertuples()]]
+
+        inactive = list(INACTIVE_POSITIONS)
+        swaps = moves['current_position'].isin(inactive) & moves['target_position'].isin(inactive)
+        to_bench = [{"player_id": int(row.player_id),
+                     "selected_position": row.target_position if swap else "BN"}
+                    for row, swap in zip(moves.itertuples(), swaps)]
+        from_bench = [{"player_id": int(row.player_id), "selected_position": row.target_position}
+                      for row in moves[~swaps].itertuples() if row.target_position != "BN"]
+        return [payload for payload in (to_bench, from_bench) if payload]
+
+    @staged("set_lineup")
+    def set_lineup(self, target: pd.DataFrame, dry_run: bool = False, when: datetime = None) -> list:
 
         """
         This function sets your line using the Yahoo Fantasy API. It accepts a pd.DataFrame indexed
@@ -338,74 +1207,93 @@ class Roster:
 
         No point in trying to construct it with anything other than optimize_lineup()
 
-        :param target: a dataframe describing a target lineup, probably generated by optimize_lineup()
+        All of the changes are sent in one change_positions() call. If Yahoo rejects that, they're
+        sent again in the two staged payloads from plan_moves(staged=True).
 
+        :param target: a dataframe describing a target lineup, probably generated by optimize_lineup()
+        :param dry_run: if True, don't change anything, just return the payloads that would be sent
+        :param when: the day to set the lineup for, if not self.when
+        :return: the payloads that were (or would be) sent to Yahoo
         """
 
-        target = target.rename(columns={"current_position": "c_pos",
-                                        "target_position": "t_pos",
-                                        "player_id": "pid"})
-
-        #  Bench players that are in the wrong position
-        move_back = []
-        for row in target.itertuples():
-            name = row.Index
-
-            # If the player's current position and target position are the same, no need to do anything
-            if row.c_pos == row.t_pos:
-                continue
-
-            # If the player is on the IL and needs to be moved to NA (or vice versa), do it in
-            # one step, otherwise YFA gets mad about too many players on a given list.
-            if row.c_pos in ["NA", "IL"] and row.t_pos in ["NA", "IL"]:
+        when = self.when if when is None else when
+
+        payloads = self.plan_moves(target)
+        moves = target[target['current_position'] != target['target_position']]
+        for row in moves.itertuples():
+            self.logger.info("Planned for {}: {} ({} -> {})".format(
+                when.date(), row.Index, row.current_position, row.target_position))
+        if dry_run or not payloads:
+            return payloads
+
+        try:
+            self.change_positions(when, payloads[0])
+            self.logger.info("Success: moved {} players in one step".format(len(payloads[0])))
+        except RuntimeError as e:
+            self.logger.warning("Failed: moving {} players in one step, trying in stages".format(len(payloads[0])))
+            self.logger.warning(e)
+            payloads = self.plan_moves(target, staged=True)
+            for stage, payload in enumerate(payloads, start=1):
                 try:
-                    swap_dict = [{"player_id": int(row.pid), "selected_position": row.t_pos}]
-                    self.team.change_positions(self.when, swap_dict)  # Bench them first
-                    self.logger.info("Success: Switched {} {} -> {}".format(name, row.c_pos, row.t_pos))
+                    self.change_positions(when, payload)
+                    self.logger.info("Success: stage {} ({} players)".format(stage, len(payload)))
                 except RuntimeError as e:
-                    self.logger.warning("Failed: Switched {} {} -> {}".format(name, row.c_pos, row.t_pos))
+                    self.logger.warning("Failed: stage {} ({} players)".format(stage, len(payload)))
                     self.logger.warning(e)
-            else:
-                try:
-                    # For all of the players that need to move, start by moving them to the bench
-                    bench_dict = [{"player_id": int(row.pid), "selected_position": "BN"}]
-                    self.team.change_positions(self.when, bench_dict)  # Bench them first
-                    # Keep a list of the players that need to be moved back from the bench
-                    move_back.append((name, row.pid, row.c_pos, row.t_pos))
-                    self.logger.info("Success: {} ({} -> {}) to BN".format(name, row.c_pos, row.t_pos))
-                except RuntimeError as e:
-                    self.logger.warning("Failed: {} ({} -> {}) to BN".format(name, row.c_pos, row.t_pos))
-                    self.logger.warning(e)
-
-        # For the players that we moved to the bench, move them back to the target position
-        for move in move_back:
-            name, pid, c_pos, t_pos = move
-            if t_pos == "BN":
-                continue
-            try:
-                move_dict = [{"player_id": int(pid), "selected_position": t_pos}]
-                self.team.change_positions(self.when, move_dict)  # Bench them first
-                self.logger.info("Success: {} ({}) to {}".format(name, c_pos, t_pos))
-            except RuntimeError as e:
-                self.logger.warning("Failed: {} ({}) to {}".format(name, c_pos, t_pos))
-                self.logger.warning(e)
+                    break
         self.logger.info("Finished setting lineup!")
+        return payloads
+
+    def change_positions(self, when: datetime, payload: list) -> None:
+        """
+        Sends one change_positions() payload to Yahoo, through the scheduler
+
+        If it fails in a way that's worth trying again (e.g., throttling or a timeout), the roster is
+        fetched again first, and the payload is only sent again if the moves didn't go through.
+
+        :param when: the day to move players on
+        :param payload: a list of {'player_id': ..., 'selected_position': ...} dicts
+        """
+        def applied() -> bool:
+            roster = self.scheduler.call("team/roster", self.team.roster, day=when)
+            current = {int(player['player_id']): player['selected_position'] for player in roster}
+            return all(current.get(int(move['player_id'])) == move['selected_position'] for move in payload)
+
+        self.scheduler.call("team/roster/put", self.team.change_positions, when, payload,
+                            idempotent=False, applied=applied)
 
     def value_players(self, how="magic", log=True):
         """
         Value players according to one of:
             * steamer - uses projections loaded as a CSV
+            * projections - a blend of every projection system in PROJECTION_SOURCES
             * lastmonth - uses the player's stats in the last month from Yahoo
             * season - uses the player's stats for the current season from Yahoo
             * magic - a weighted combination of the above three
 
         :param how: The method through which value is assigned to a player
         :param log: Whether to add a line to the logger (so recursive calls can be silent)
-        :return: a list of player values that correspond to the players in self.roster
+        :return: a series of player values, indexed by player_id
         """
         if log:
             self.logger.info('Valuing players by "{}" method...'.format(how))
 
+        # Each method is only worked out once per Roster (or again, if a player has joined the roster since)
+        if how not in self.valuations or not self.players['player_id'].isin(self.valuations[how].index).all():
+            values = self.compute_values(how)
+            if values is None:
+                return None
+            self.valuations[how] = values
+        return self.valuations[how]
+
+    def compute_values(self, how):
+        """
+        Does the actual work for value_players(), without memoizing anything
+
+        :param how: The method through which value is assigned to a player
+        :return: a series of player values, indexed by player_id
+        """
+
         if how == "steamer":
 
             """
@@ -416,28 +1304,28 @@ class Roster:
                 * the player's name (as 'Name')
                 * a representation of the player's value (as 'WAR')
             
+            The CSVs are compiled into data/compiled/steamer the first time they're
+            used (and again whenever they change), so this is just a lookup per player.
+            Each player is matched to a projection by name, team and position type once,
+            and looked up by player_id after that.
             """
 
-            # WAR projections for each player that are used to break ties
-            # Define where to find WAR projections for each player
-            batter_value_path = "data/proj_steamer_2020_b.csv"
-            pitcher_value_path = "data/proj_steamer_2020_p.csv"
+            # Players without a projection are valued slightly more than known nothings
+            return self.steamer.lookup_players(self.players)
 
-            player_values = pd.read_csv(
-                batter_value_path  # Batter projections
-            ).append(pd.read_csv(
-                pitcher_value_path))  # Pitcher projections
+        if how == "projections":
 
-            # If there are two players with the same name, only keep the
-            # the player with the most projected ABs or IPs
-            player_values = player_values.sort_values(by=['AB', 'IP'])
-            player_values = player_values.drop_duplicates(subset=['Name'], keep='last')
+            """
+            Players are assigned value by blending several projection systems (see PROJECTION_SOURCES)
 
-            # Clean up the names
-            player_values['name'] = player_values['Name'].map(self.cleanup_name)
-            player_values['WAR'] = player_values['WAR'].fillna(0.1)  # Value unknowns slightly more than known nothings
+            Each system's values are put on a common scale first (distance from the median
+            projected batter or pitcher), and then averaged using each system's weight,
+            leaving out systems that don't have a projection for a player. As with "magic",
+            the blend is centered on 3, so only really bad players are worth less than nothing.
+            A system's CSVs are only read again when they change.
+            """
 
-            return player_values['WAR'][player_values['name'].isin(self.roster["name"])].tolist()
+            return self.projections.lookup_players(self.players)
 
         if how == "lastmonth":
             """
@@ -447,17 +1335,9 @@ class Roster:
             Pitchers are assigned value according to 1/ERA (if ERA = 0, use 100)
             """
 
-            pids = [pid for pid in self.roster['player_id']]
-            stats = pd.DataFrame(self.league.player_stats(pids, req_type='lastmonth'))
-            values = []
-            for ops, era in zip(stats['OPS'], stats['ERA']):
-                if not np.isnan(ops):
-                    values.append(ops)
-                elif era == 0:
-                    values.append(100)
-                else:
-                    values.append(1/era)
-            return values
+            pids = [pid for pid in self.players['player_id']]
+            stats = self.scheduler.call("league/players/stats", self.league.player_stats, pids, req_type='lastmonth')
+            return stat_values(pd.DataFrame(stats), how)
 
         if how == "season":
             """
@@ -468,17 +1348,9 @@ class Roster:
             For pitchers, players are valued by 1/FIP (if FIP == 0, then we use 100)
             """
 
-            pids = [pid for pid in self.roster['player_id']]
-            stats = pd.DataFrame(self.league.player_stats(pids, req_type='season'))
-            values = []
-            for wRAA, fip in zip(stats['wRAA'], stats['FIP']):
-                if not np.isnan(wRAA):
-                    values.append(wRAA)
-                elif fip == 0:
-                    values.append(100)
-                else:
-                    values.append(1/fip)
-            return values
+            pids = [pid for pid in self.players['player_id']]
+            stats = self.scheduler.call("league/players/stats", self.league.player_stats, pids, req_type='season')
+            return stat_values(pd.DataFrame(stats), how)
 
         if how == "magic":
 
@@ -490,38 +1362,24 @@ class Roster:
             weights become more important to the valuation.
                 """
 
-            def mad(x):
-                """
-                Median absolute deviation
-                (like a standard deviation except for non-parametric data)
-                """
-                x = np.array(x)
-                return np.median(abs(x - np.median(x)))
+            pids = self.players['player_id'].astype(int).to_numpy()
 
-            def norm_np(x, center=3):
-                """
-                Normalize a vector non-parametrically
-                (distance from the median in MAD units)
-
-                'center' helps prevent really bad players from being started
-                e.g., center=3 means a player that is three MAD units below the median
-                (99th percentile bad) will never be a starter, since his value is negative
-                """
-                x = np.array(x)
-                return (x - np.median(x))/mad(x) + center
+            # Fetch the season stats, last month stats and projections all at once,
+            # so this takes about as long as the slowest of them
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                # (copy_context() so the calls are counted against this Roster's metrics)
+                sources = {source: pool.submit(contextvars.copy_context().run, self.value_players, source, False)
+                           for source in ("season", "lastmonth", "steamer")}
+                week = self.cache.get("current_week", self.league_key,
+                                      lambda: self.scheduler.call("league/scoreboard", self.league.current_week))
 
-            week = self.league.current_week()
-            total_weeks = 9  # Only valid for shortened 2020 season
-            weight_season = (week/total_weeks * 0.75 + 0.25) * 1/2
-            weight_month = (week/total_weeks * 0.75 + 0.25) * 1/2
-            weight_proj = 1 - weight_season - weight_month
+            # Line the values up with the roster by player_id (players Yahoo has no stats for get 'center')
+            raw = pd.DataFrame({source: sources[source].result().reindex(pids) for source in sources}, index=pids)
 
-            # Calculate weights for season stats, this month stats, and steamer projections
-            this_season = norm_np(self.value_players("season", log=False)) * weight_season
-            this_month = norm_np(self.value_players("lastmonth", log=False)) * weight_month
-            projections = norm_np(self.value_players("steamer", log=False)) * weight_proj
-
-            return this_season + this_month + projections
+            # The scale the roster was valued on is kept, so other players (e.g., free agents) can be put on it too
+            self.blend = {"norms": {source: norm_params(raw[source]) for source in raw},
+                          "weights": magic_weights(week, **self.magic)}
+            return blend_values(raw, **self.blend)
 
         else:
             self.logger.info('Don\'t know how to value players by "{}"'.format(how))
@@ -529,9 +1387,59 @@ class Roster:
 
 
 if __name__ == "__main__":
-    LEAGUE = "Chemical Hydrolysis League"
-    token = update_oauth()
-    key = find_league_key(token, 'mlb', LEAGUE)
-    ros = Roster(key, values="magic")
-    opt = ros.optimize_lineup()
-    ros.set_lineup(opt)
+    parser = argparse.ArgumentParser(description="Set the lineups of Yahoo Fantasy Baseball teams")
+    parser.add_argument("leagues", nargs="*", default=["Chemical Hydrolysis League"],
+                        help="league names or keys (e.g., 398.l.12345)")
+    parser.add_argument("--values", default="magic", help="how to value players (default: magic)")
+    parser.add_argument("--workers", type=int, default=4, help="how many teams to work on at once")
+    parser.add_argument("--dry-run", action="store_true", help="work out the lineups without changing anything")
+    parser.add_argument("--days", type=int, default=1, help="how many days of lineups to set (default: 1)")
+    parser.add_argument("--check", action="store_true",
+                        help="only find out whether there's anything to change (as cheaply as possible)")
+    parser.add_argument("--list-leagues", action="store_true", help="list your leagues and their keys, then quit")
+    parser.add_argument("--cache-dir", help="keep API responses here, so back-to-back runs can reuse them")
+    parser.add_argument("--record", metavar="PATH", help="save every API response to PATH (see fixtures.py)")
+    parser.add_argument("--replay", metavar="PATH", help="answer every API call from a recording instead")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running, and set the lineups whenever something changes")
+    parser.add_argument("--poll", type=float, default=30,
+                        help="with --daemon, how many minutes between looks before the first game (default: 30)")
+    parser.add_argument("--schedule", default="data/schedule.json",
+                        help="where to keep the season's schedule (see schedule.py)")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="how many Yahoo calls a second to make, across all teams (default: 5)")
+    parser.add_argument("--metrics", metavar="PATH", help="write per-team stage timings and API call counts to PATH (JSON)")
+    args = parser.parse_args()
+
+    if args.list_leagues:
+        find_league_key(update_oauth(), 'mlb')
+        sys.exit(0)
+
+    if args.record or args.replay:
+        import fixtures
+        if args.record:
+            api = fixtures.record(args.record, sys.modules[__name__])
+        else:
+            api = fixtures.replay(args.replay, sys.modules[__name__])
+    else:
+        api = contextlib.nullcontext()
+
+    if args.daemon:
+        with api:
+            run_daemon(args.leagues, values=args.values, workers=args.workers, dry_run=args.dry_run,
+                       cache_dir=args.cache_dir, poll=timedelta(minutes=args.poll), rate=args.rate,
+                       schedule_path=args.schedule)
+        sys.exit(0)
+
+    with api:
+        report = run_leagues(args.leagues, values=args.values, workers=args.workers, dry_run=args.dry_run,
+                             cache_dir=args.cache_dir, check=args.check, days=args.days, rate=args.rate,
+                             schedule_path=args.schedule)
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(json.dumps([team["metrics"] for team in report if team["metrics"]], indent=2))
+
+    for team in report:
+        print("{league}: {status} ({seconds:.1f}s)".format(
+            status="{} moves".format(team["moves"]) if team["ok"] else "failed, " + team["error"], **team))
+    sys.exit(0 if all(team["ok"] for team in report) else 1)
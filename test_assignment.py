@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from set_lineup import Assignment
+
+optimize = pytest.importorskip("scipy.optimize")
+
+
+def best_total(weights: np.ndarray) -> float:
+    """
+    The most weight any matching of the rows can get, according to scipy
+    """
+    rows, cols = optimize.linear_sum_assignment(weights, maximize=True)
+    return weights[rows, cols].sum()
+
+
+def check(assignment: Assignment, weights: np.ndarray) -> None:
+    """
+    Checks that every row is paired with a different column, and that the pairing is as good as scipy's
+    """
+    matching = assignment.matching()
+    assert (matching >= 0).all()
+    assert len(set(matching)) == len(matching)
+    assert weights[np.arange(len(matching)), matching].sum() == pytest.approx(best_total(weights))
+
+
+def random_weights(rng: np.random.Generator, n: int, m: int) -> np.ndarray:
+    """
+    Weights like slot_weights() makes: mostly 0 (a player can't go there), with plenty of ties
+    """
+    kind = rng.integers(3)
+    if kind == 0:
+        weights = rng.random((n, m))
+    elif kind == 1:
+        weights = rng.integers(0, 4, (n, m)).astype(float)
+    else:
+        weights = np.where(rng.random((n, m)) < 0.4, 100 + rng.integers(0, 10, (n, m)), 0.0)
+    return weights
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 12))
+    m = n + int(rng.integers(0, 12))
+    weights = random_weights(rng, n, m)
+    check(Assignment(weights), weights)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_update_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 12))
+    m = n + int(rng.integers(0, 12))
+    weights = random_weights(rng, n, m)
+    assignment = Assignment(weights)
+    for _ in range(10):
+        cols = rng.choice(m, size=int(rng.integers(1, m + 1)), replace=False)
+        new = random_weights(rng, n, len(cols))
+        weights[:, cols] = new
+        assignment.update(cols, new)
+        check(assignment, weights)
+
+
+def test_more_rows_than_columns():
+    with pytest.raises(ValueError):
+        Assignment(np.ones((3, 2)))